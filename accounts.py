@@ -26,3 +26,13 @@ def get_account(alias: str | None = None, path: str = DEFAULT_ACCOUNTS_PATH) ->
 def get_account_from_env(env_var: str = "ACCOUNT_ALIAS") -> dict:
     alias = os.getenv(env_var)
     return get_account(alias=alias)
+
+
+GENERATION_MODES = ("describe", "image_to_image")
+
+
+def get_generation_mode(account: dict) -> str:
+    mode = (account.get("generation_mode") or "describe").strip().lower()
+    if mode not in GENERATION_MODES:
+        raise RuntimeError(f"Unknown generation_mode for {account.get('alias')}: {mode}")
+    return mode
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import threading
@@ -11,7 +12,9 @@ import main1
 import main3
 import parse
 import prompts
+import providers
 import proxy
+import retry
 import settings
 
 STATE_PATH = os.path.join(os.path.dirname(__file__), "bot_state.json")
@@ -145,28 +148,29 @@ def update_job(state: dict, job_id: str, **kwargs) -> None:
 def run_pipeline(token: str, chat_id: int, user_id: str, job_id: str, account_alias: str, model: str):
     state = load_state()
     update_job(state, job_id, status="running", started_at=time.time())
+    retry.reset_stats()
     try:
         account = accounts.get_account(account_alias)
         send_message(token, chat_id, f"▶ Парсинг начат ({account_alias})")
         parse.run_bot(account, headless=True)
 
         send_message(token, chat_id, f"▶ Генерация начата ({model})")
-        if model == "gemini":
+        media_kind = "video" if model == "video" else "image"
+        if settings.get_setting("async_engine", default=False):
+            asyncio.run(providers.process_account(account, model=model))
+        elif model == "gemini":
             main1.process_account(account)
-            media_kind = "image"
         elif model == "openai":
             main.process_account(account)
-            media_kind = "image"
         else:
             main3.process_account_videos(account["alias"])
-            media_kind = "video"
 
         send_message(token, chat_id, "▶ Публикация начата")
-        for board_id in proxy.list_account_board_ids(account):
-            proxy.publish_generated_board(account, board_id, media_kind=media_kind)
+        proxy.publish_generated_boards(account, proxy.list_account_board_ids(account), media_kind=media_kind)
 
         update_job(state, job_id, status="done", finished_at=time.time())
-        send_message(token, chat_id, "✅ Готово")
+        stats = retry.format_stats()
+        send_message(token, chat_id, "✅ Готово" + (f"\n\nRetry:\n{stats}" if stats else ""))
     except Exception as e:
         err = f"{type(e).__name__}: {e}"
         update_job(state, job_id, status="error", error=err, finished_at=time.time())
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_NAME = "_manifest.json"
+
+# Шаги пина в порядке выполнения
+STEPS = ("described", "generated", "metadata", "saved")
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def atomic_write_json(path: str, data) -> None:
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class BoardManifest:
+    """
+    Состояние шагов по каждому пину доски (_manifest.json в папке вывода).
+    Пишется атомарно после каждого шага, чтобы перезапуск продолжал
+    с места падения и не платил повторно за готовые вызовы.
+    """
+
+    def __init__(self, out_dir: str):
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._data = {"pins": {}}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠ Манифест повреждён, начинаю заново: {self.path} ({e})")
+        self._data.setdefault("pins", {})
+
+    def pin(self, index: int, source_path: str) -> dict:
+        """
+        Запись пина; если референс под этим индексом сменился
+        (новый парсинг), прошлые шаги сбрасываются
+        """
+        source_hash = file_hash(source_path)
+        with self._lock:
+            entry = self._data["pins"].get(str(index))
+            if not entry or entry.get("source_hash") != source_hash:
+                entry = {"source": os.path.basename(source_path), "source_hash": source_hash}
+                self._data["pins"][str(index)] = entry
+                self._save()
+            return dict(entry)
+
+    def update(self, index: int, step: str, **fields) -> None:
+        if step not in STEPS:
+            raise ValueError(f"Unknown step: {step}")
+        with self._lock:
+            entry = self._data["pins"].setdefault(str(index), {})
+            entry.update(fields)
+            entry[step] = time.time()
+            self._save()
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        atomic_write_json(self.path, self._data)
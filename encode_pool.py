@@ -0,0 +1,100 @@
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import settings
+
+# ================== CONFIG ==================
+
+# x264 хорошо масштабируется примерно до 4 потоков на кодирование
+THREADS_PER_ENCODE_HINT = 4
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+_queued = 0
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def workers() -> int:
+    configured = int(settings.get_setting("video_encode_workers", default=0) or 0)
+    if configured > 0:
+        return configured
+    return max(1, available_cores() // THREADS_PER_ENCODE_HINT)
+
+
+def threads_per_worker() -> int:
+    return max(1, available_cores() // workers())
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=workers(), thread_name_prefix="ffmpeg")
+            print(f"🎞 Encode pool: {workers()} x {threads_per_worker()} threads ({available_cores()} cores)")
+        return _pool
+
+
+# ================== RUN ==================
+
+def _wait(proc: subprocess.Popen) -> float | None:
+    """
+    Ждёт процесс и возвращает его CPU-время (user + sys);
+    wait4 есть только на POSIX
+    """
+    if not hasattr(os, "wait4"):
+        proc.wait()
+        return None
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(cmd: list[str], label: str, feed) -> dict:
+    global _queued
+    with _pool_lock:
+        _queued -= 1
+
+    started = time.monotonic()
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE if feed else None)
+    try:
+        if feed:
+            try:
+                feed(proc.stdin)
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+    finally:
+        cpu = _wait(proc)
+    wall = time.monotonic() - started
+
+    cpu_info = f", cpu {cpu:.1f} s" if cpu is not None else ""
+    print(f"🎞 Encode {label}: wall {wall:.1f} s{cpu_info} (в очереди {_queued})")
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd[0])
+    return {"wall_sec": wall, "cpu_sec": cpu}
+
+
+def submit(cmd: list[str], label: str = "", feed=None) -> Future:
+    """
+    Ставит вызов ffmpeg в общий пул кодирования; -threads в cmd
+    берётся из threads_per_worker(). feed(stdin) — запись входа
+    в stdin процесса (для потоковой обработки, cmd читает pipe:0)
+    """
+    global _queued
+    with _pool_lock:
+        _queued += 1
+    return _executor().submit(_run, cmd, label or "ffmpeg", feed)
+
+
+def run(cmd: list[str], label: str = "", feed=None) -> dict:
+    return submit(cmd, label, feed).result()
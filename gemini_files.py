@@ -0,0 +1,109 @@
+import hashlib
+import os
+import time
+from datetime import datetime
+
+import requests
+
+import retry
+import settings
+import upload_cache
+
+# ================== CONFIG ==================
+
+UPLOAD_URL = "https://generativelanguage.googleapis.com/upload/v1beta/files"
+CACHE_PATH = os.path.join(os.path.dirname(__file__), "gemini_files_cache.json")
+
+# Файлы живут 48 ч; не используем ссылку, если до истечения меньше часа
+EXPIRY_MARGIN_SEC = 3600
+DEFAULT_TTL_SEC = 48 * 3600
+
+_CACHE = upload_cache.UploadCache(CACHE_PATH, margin_sec=EXPIRY_MARGIN_SEC)
+
+
+def _api_key() -> str:
+    return settings.get_setting("gemini_api_key", env_var="GEMINI_API_KEY") or ""
+
+
+def _mime_type(path: str) -> str:
+    return "image/png" if path.lower().endswith(".png") else "image/jpeg"
+
+
+def _parse_expiry(value: str | None) -> float:
+    if not value:
+        return time.time() + DEFAULT_TTL_SEC
+    # "2025-01-01T00:00:00.123456789Z" — дробная часть может быть длиннее микросекунд
+    base = value.split(".")[0].rstrip("Z")
+    return datetime.fromisoformat(base + "+00:00").timestamp()
+
+
+# ================== UPLOAD ==================
+
+def upload_file(data: bytes, mime_type: str, display_name: str) -> dict:
+    """
+    Resumable upload в Gemini Files API, возвращает объект file
+    (uri, name, mimeType, expirationTime)
+    """
+    key = _api_key()
+
+    def _start():
+        r = requests.post(
+            UPLOAD_URL,
+            headers={
+                "x-goog-api-key": key,
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(len(data)),
+                "X-Goog-Upload-Header-Content-Type": mime_type,
+                "Content-Type": "application/json",
+            },
+            json={"file": {"display_name": display_name}},
+            timeout=30,
+        )
+        r.raise_for_status()
+        upload_url = r.headers.get("x-goog-upload-url")
+        if not upload_url:
+            raise RuntimeError("Gemini Files API: upload URL not returned")
+        return upload_url
+
+    upload_url = retry.call(_start, provider="gemini", model="files")
+
+    def _upload():
+        r = requests.post(
+            upload_url,
+            headers={
+                "Content-Length": str(len(data)),
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize",
+            },
+            data=data,
+            timeout=120,
+        )
+        r.raise_for_status()
+        return r.json()["file"]
+
+    return retry.call(_upload, provider="gemini", model="files", idempotent=False)
+
+
+def file_part(image_path: str) -> dict:
+    """
+    fileData-ссылка на референс: загружается один раз на содержимое,
+    дальше берётся из кэша до истечения срока
+    """
+    with open(image_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+
+    def _upload() -> dict:
+        mime_type = _mime_type(image_path)
+        uploaded = upload_file(data, mime_type, os.path.basename(image_path))
+        print(f"⬆ Reference uploaded to Gemini Files: {os.path.basename(image_path)}")
+        return {
+            "uri": uploaded["uri"],
+            "name": uploaded.get("name"),
+            "mime_type": uploaded.get("mimeType") or mime_type,
+            "expires_at": _parse_expiry(uploaded.get("expirationTime")),
+        }
+
+    entry = _CACHE.get_or_create(digest, _upload)
+    return {"fileData": {"mimeType": entry["mime_type"], "fileUri": entry["uri"]}}
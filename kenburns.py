@@ -0,0 +1,135 @@
+from PIL import Image, ImageOps
+
+import video_cover
+
+# ================== CONFIG ==================
+
+# Вертикальное 2:3, как у пинов
+WIDTH = 1080
+HEIGHT = 1620
+FPS = 30
+
+# Два плана (наезд и панорама) склеиваются плавным переходом
+CROSSFADE_SEC = 0.8
+ZOOM_MAX = 1.10
+PAN_ZOOM = 1.08
+
+# Простое разделение глубины: нижняя часть кадра — передний план.
+# Он повторяет движение фона, но с амплитудой больше на PARALLAX_DEPTH
+FOREGROUND_SHARE = 0.45
+FOREGROUND_FEATHER = 0.25
+PARALLAX_DEPTH = 0.35
+
+
+# ================== LAYERS ==================
+
+def parallax_layer(image_path: str, out_path: str) -> str:
+    """
+    Передний план для параллакса: кадр целиком (RGBA), непрозрачна только
+    нижняя часть с мягким верхним краем — двигается тем же наездом и
+    панорамой, что и фон, поэтому на стыке нет шва
+    """
+    with Image.open(image_path) as img:
+        fg = ImageOps.fit(ImageOps.exif_transpose(img).convert("RGB"), (WIDTH, HEIGHT), Image.LANCZOS)
+
+    top = int(HEIGHT * (1 - FOREGROUND_SHARE))
+    feather = max(1, int((HEIGHT - top) * FOREGROUND_FEATHER))
+    alpha = Image.new("L", fg.size, 0)
+    alpha.paste(255, (0, top + feather, WIDTH, HEIGHT))
+    for row in range(feather):
+        alpha.paste(int(255 * row / feather), (0, top + row, WIDTH, top + row + 1))
+    fg.putalpha(alpha)
+    fg.save(out_path)
+    return out_path
+
+
+# ================== FILTERS ==================
+
+def _zoompan(expr_z: str, expr_x: str, frames: int) -> str:
+    return (
+        f"zoompan=z='{expr_z}':x='{expr_x}':y='ih/2-(ih/zoom/2)'"
+        f":d={frames}:s={WIDTH}x{HEIGHT}:fps={FPS}"
+    )
+
+
+def _motion(src: str, out: str, duration: float, gain: float = 1.0) -> list[str]:
+    """
+    Наезд к центру, затем переход в медленную панораму слева направо;
+    gain масштабирует амплитуду зума (и вместе с ним ход панорамы)
+    """
+    seg = (duration + CROSSFADE_SEC) / 2
+    frames = int(round(seg * FPS))
+    zoom_max = (ZOOM_MAX - 1) * gain
+    pan_zoom = 1 + (PAN_ZOOM - 1) * gain
+
+    # Увеличение до 2x перед zoompan убирает дрожание при дробном зуме
+    return [
+        f"[{src}]scale={WIDTH * 2}:{HEIGHT * 2}:force_original_aspect_ratio=increase,"
+        f"crop={WIDTH * 2}:{HEIGHT * 2},setsar=1,split=2[{out}a][{out}b]",
+        f"[{out}a]" + _zoompan(f"1+{zoom_max:.3f}*on/{frames}", "iw/2-(iw/zoom/2)", frames) + f"[{out}0]",
+        f"[{out}b]" + _zoompan(f"{pan_zoom:.3f}", f"(iw-iw/zoom)*on/{frames}", frames) + f"[{out}1]",
+        f"[{out}0][{out}1]xfade=transition=fade:duration={CROSSFADE_SEC}:offset={seg - CROSSFADE_SEC:.3f}[{out}]",
+    ]
+
+
+def filter_graph(duration: float, parallax: bool = False, text_layer: bool = False,
+                 text_x: str = "(W-w)/2", text_y: str = "H*0.08") -> str:
+    """
+    [0] — картинка, [1] — слой параллакса (если есть), следующий — текст.
+    Чистая функция: граф собирается и проверяется без ffmpeg
+    """
+    parts = _motion("0:v", "bg", duration)
+    last = "bg"
+    next_input = 1
+    if parallax:
+        # Передний план тем же движением, но с большей амплитудой — ощущение глубины
+        parts += _motion(f"{next_input}:v", "fg", duration, gain=1 + PARALLAX_DEPTH)
+        parts.append(f"[{last}][fg]overlay=0:0:shortest=1[v1]")
+        last = "v1"
+        next_input += 1
+    if text_layer:
+        parts.append(f"[{last}][{next_input}:v]overlay=x={text_x}:y={text_y}:shortest=1[v2]")
+        last = "v2"
+    parts.append(f"[{last}]format=yuv420p[out]")
+    return ";".join(parts)
+
+
+def build_command(
+    image_path: str,
+    out_mp4: str,
+    duration: float,
+    encode_args: list[str],
+    parallax_path: str | None = None,
+    text_layer_path: str | None = None,
+    text_x: str = "(W-w)/2",
+    text_y: str = "H*0.08",
+    cover_for: str | None = None,
+) -> list[str]:
+    """
+    Аргументы ffmpeg для рендера; сам рендер требует ffmpeg в PATH
+    """
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", image_path]
+    if parallax_path:
+        # один кадр, как и [0]: zoompan сам растягивает его на весь план
+        cmd += ["-i", parallax_path]
+    if text_layer_path:
+        cmd += ["-loop", "1", "-i", text_layer_path]
+    graph = filter_graph(duration, bool(parallax_path), bool(text_layer_path), text_x, text_y)
+    video_label, cover_outputs = "[out]", []
+    if cover_for:
+        graph = f"{graph};{video_cover.graph('out')}"
+        video_label, cover_outputs = "[vout]", video_cover.output_args(cover_for)
+    return [
+        *cmd,
+        "-filter_complex",
+        graph,
+        "-map",
+        video_label,
+        "-t",
+        f"{duration}",
+        "-r",
+        str(FPS),
+        *encode_args,
+        out_mp4,
+        *cover_outputs,
+    ]
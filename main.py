@@ -1,16 +1,49 @@
 import os
 import base64
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import accounts
+import checkpoint
+import pin_metadata
 import prompts
+import quality_gate
+import retry
 import settings
+import taskgraph
+import transcode
 
 
 
 OPENAI_KEY = (
     settings.get_setting("openai_api_key", env_var="OPENAI_API_KEY") or ""
 ).strip()
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Пул для шагов внутри одной картинки (описание → картинка || SEO)
+_GRAPH_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(settings.get_setting("image_graph_workers", default=8)),
+    thread_name_prefix="image-graph",
+)
+
+
+def _post_openai(endpoint: str, payload: dict, timeout: int = 60) -> dict:
+    def _do():
+        r = requests.post(
+            f"{OPENAI_BASE_URL}/{endpoint}",
+            headers={
+                "Authorization": f"Bearer {OPENAI_KEY}",
+                "Content-Type": "application/json"
+            },
+            json=payload,
+            timeout=timeout
+        )
+        r.raise_for_status()
+        return r.json()
+
+    return retry.call(_do, provider="openai", model=payload.get("model", ""))
 
 
 
@@ -48,18 +81,9 @@ def describe_image(image_path: str) -> str:
         ]
     }
 
-    r = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {OPENAI_KEY}",
-            "Content-Type": "application/json"
-        },
-        json=payload,
-        timeout=60
-    )
-    r.raise_for_status()
+    resp = _post_openai("chat/completions", payload, timeout=60)
 
-    return r.json()["choices"][0]["message"]["content"]
+    return resp["choices"][0]["message"]["content"]
 
 
 # ================== 2) ГЕНЕРАЦИЯ ИЗОБРАЖЕНИЯ ==================
@@ -68,7 +92,14 @@ def generate_image_from_description(description: str) -> bytes:
     """
     GPT-Image-1 по улучшенному prompt
     """
+    return generate_images_from_description(description, 1)[0]
+
 
+def generate_images_from_description(description: str, n: int) -> list[bytes]:
+    """
+    n вариантов одним запросом (параметр n); если API отказал или вернул
+    меньше — добор отдельными запросами
+    """
     prompt = prompts.render_prompt("openai_image_prompt", description=description)
 
     payload = {
@@ -76,116 +107,238 @@ def generate_image_from_description(description: str) -> bytes:
         "prompt": prompt,
         "size": "1024x1024"
     }
+    if n > 1:
+        payload["n"] = n
 
-    r = requests.post(
-        "https://api.openai.com/v1/images/generations",
-        headers={"Authorization": f"Bearer {OPENAI_KEY}"},
-        json=payload,
-        timeout=90
-    )
-    r.raise_for_status()
-    b64 = r.json()["data"][0]["b64_json"]
-    return base64.b64decode(b64)
+    try:
+        resp = _post_openai("images/generations", payload, timeout=90 + 30 * (n - 1))
+    except requests.exceptions.HTTPError as e:
+        if n == 1 or e.response is None or e.response.status_code != 400:
+            raise
+        print("⚠ n не поддерживается, генерирую по одной")
+        return [generate_image_from_description(description) for _ in range(n)]
+
+    images = [base64.b64decode(d["b64_json"]) for d in resp["data"][:n]]
+    while len(images) < n:
+        images.append(generate_image_from_description(description))
+    return images
+
+
+def restyle_image(image_path: str) -> bytes:
+    """
+    GPT-Image-1 edits: новая картинка сразу по референсу, без шага описания
+    """
+    prompt = prompts.render_prompt("openai_restyle_prompt")
+    mime_type = "image/png" if image_path.lower().endswith(".png") else "image/jpeg"
+
+    def _do():
+        with open(image_path, "rb") as f:
+            r = requests.post(
+                f"{OPENAI_BASE_URL}/images/edits",
+                headers={"Authorization": f"Bearer {OPENAI_KEY}"},
+                data={"model": "gpt-image-1", "prompt": prompt, "size": "1024x1024"},
+                files={"image": (os.path.basename(image_path), f, mime_type)},
+                timeout=120
+            )
+        r.raise_for_status()
+        return r.json()
+
+    resp = retry.call(_do, provider="openai", model="gpt-image-1")
+    return base64.b64decode(resp["data"][0]["b64_json"])
 
 
 # ================== 3) ГЕНЕРАЦИЯ SEO-МЕТАДАННЫХ ==================
 
-def generate_seo_metadata(board_name: str, description: str) -> dict:
+SEO_METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+        "hashtags": {"type": "array", "items": {"type": "string"}},
+        "alt": {"type": "string"},
+    },
+    "required": ["title", "description", "hashtags", "alt"],
+    "additionalProperties": False,
+}
+
+
+def generate_seo_metadata(board_name: str, description: str = "", image_path: str | None = None) -> dict:
     """
     Делает:
     - SEO title
     - Pinterest description
     - 10 хештегов
     - alt-text
+    По описанию стиля или, если передан image_path, прямо по картинке
+    (режим image_to_image: без отдельного шага описания)
     """
+    source = "Image: attached" if image_path else f"Image style description: {description}"
+    text = (
+        f"Board: {board_name}\n\n"
+        f"{source}\n\n"
+        "Generate Pinterest metadata:\n"
+        "- short SEO title (max 60 chars)\n"
+        "- Pinterest pin description (1–2 sentences)\n"
+        "- 10 aesthetic hashtags\n"
+        "- alt-text (1 sentence)\n"
+        "Return JSON keys: title, description, hashtags, alt"
+    )
+    content = text
+    if image_path:
+        with open(image_path, "rb") as f:
+            b64 = base64.b64encode(f.read()).decode()
+        content = [
+            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64}"}},
+            {"type": "text", "text": text},
+        ]
+
     payload = {
         "model": "gpt-4.1",
         "messages": [
             {
                 "role": "user",
-                "content": (
-                    f"Board: {board_name}\n\n"
-                    f"Image style description: {description}\n\n"
-                    "Generate Pinterest metadata:\n"
-                    "- short SEO title (max 60 chars)\n"
-                    "- Pinterest pin description (1–2 sentences)\n"
-                    "- 10 aesthetic hashtags\n"
-                    "- alt-text (1 sentence)\n"
-                    "Return JSON keys: title, pin_description, hashtags, alt"
-                )
+                "content": content,
             }
-        ]
+        ],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "pin_metadata",
+                "strict": True,
+                "schema": SEO_METADATA_SCHEMA,
+            },
+        },
     }
 
-    r = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {OPENAI_KEY}",
-            "Content-Type": "application/json"
-        },
-        json=payload,
-        timeout=40
-    )
-    r.raise_for_status()
+    resp = _post_openai("chat/completions", payload, timeout=40)
 
-    return json.loads(r.json()["choices"][0]["message"]["content"])
+    return pin_metadata.normalize_metadata(json.loads(resp["choices"][0]["message"]["content"]))
 
 
 # ================== 4) PIPELINE ДЛЯ 1 КАРТИНКИ ==================
 
-def process_single_image(image_path: str, out_dir: str, board_name: str, index: int):
+def process_single_image(
+    image_path: str,
+    out_dir: str,
+    board_name: str,
+    index: int,
+    mode: str = "describe",
+    manifest: checkpoint.BoardManifest | None = None,
+):
     print(f"\n📸 Обработка изображения {index}: {image_path}")
-
-    # 1. Описание
-    try:
-        description = describe_image(image_path)
-    except Exception as e:
-        print(f"❌ Ошибка описания изображения: {image_path} ({e})")
-        return None, None
-    print("📝 Описание:", description)
-
-    # 2. Генерация новой картинки
-    print("🎨 Генерация нового изображения…")
-    try:
-        new_img_bytes = generate_image_from_description(description)
-    except Exception as e:
-        print(f"❌ Ошибка генерации изображения: {image_path} ({e})")
-        return None, None
-
-    # 3. Генерация SEO-текста
-    try:
-        metadata = generate_seo_metadata(board_name, description)
-    except Exception as e:
-        print(f"❌ Ошибка генерации метаданных: {board_name} ({e})")
-        return None, None
-
-    # 4. Сохранение
+    started = time.monotonic()
     os.makedirs(out_dir, exist_ok=True)
 
-    img_path = os.path.join(out_dir, f"{index}.jpg")
+    img_path = os.path.join(out_dir, f"{index}{transcode.output_ext()}")
     json_path = os.path.join(out_dir, f"{index}.json")
 
-    try:
-        with open(img_path, "wb") as f:
-            f.write(new_img_bytes)
-    except Exception as e:
-        print(f"❌ Ошибка сохранения изображения: {img_path} ({e})")
+    manifest = manifest or checkpoint.BoardManifest(out_dir)
+    state = manifest.pin(index, image_path)
+    if state.get("saved") and os.path.isfile(img_path) and os.path.isfile(json_path):
+        print(f"⏭ Пин {index} уже готов, пропускаю")
+        return img_path, json_path
+
+    api_calls = []
+
+    # 1. Описание → (2. картинка || 3. SEO-текст): оба шага зависят только от описания.
+    # В режиме image_to_image описания нет: картинка строится прямо по референсу,
+    # метаданные — одним vision-вызовом по нему же, оба параллельно.
+    # Шаги, отмеченные в манифесте, берутся из него без повторного вызова API.
+    def _describe():
+        if state.get("described"):
+            print("⏭ Описание из манифеста")
+            return state["description"]
+        description = describe_image(image_path)
+        api_calls.append("describe")
+        manifest.update(index, "described", description=description)
+        print("📝 Описание:", description)
+        return description
+
+    def _save_image(img_bytes: bytes) -> str:
+        transcode.save_generated(img_bytes, img_path)
+        manifest.update(index, "generated", image_path=img_path)
+        return img_path
+
+    def _generate(description):
+        if state.get("generated") and os.path.isfile(img_path):
+            print("⏭ Картинка из манифеста")
+            return img_path
+        print("🎨 Генерация нового изображения…")
+        img_bytes = generate_image_from_description(description)
+        api_calls.append("image")
+        return _save_image(img_bytes)
+
+    def _restyle():
+        if state.get("generated") and os.path.isfile(img_path):
+            print("⏭ Картинка из манифеста")
+            return img_path
+        print("🎨 Генерация нового изображения по референсу…")
+        img_bytes = restyle_image(image_path)
+        api_calls.append("image")
+        return _save_image(img_bytes)
+
+    def _metadata(description):
+        if state.get("metadata"):
+            return state["seo"]
+        metadata = generate_seo_metadata(board_name, description)
+        api_calls.append("metadata")
+        manifest.update(index, "metadata", seo=metadata)
+        return metadata
+
+    def _metadata_from_image():
+        if state.get("metadata"):
+            return state["seo"]
+        metadata = generate_seo_metadata(board_name, image_path=image_path)
+        api_calls.append("metadata")
+        manifest.update(index, "metadata", seo=metadata)
+        return metadata
+
+    if mode == "image_to_image":
+        tasks = {
+            "image": (_restyle, []),
+            "metadata": (_metadata_from_image, []),
+        }
+    else:
+        tasks = {
+            "description": (_describe, []),
+            "image": (_generate, ["description"]),
+            "metadata": (_metadata, ["description"]),
+        }
+    results, errors = taskgraph.run_graph(tasks, _GRAPH_EXECUTOR)
+
+    if "image" in errors:
+        if "description" in errors:
+            print(f"❌ Ошибка описания изображения: {image_path} ({errors['description']})")
+        else:
+            print(f"❌ Ошибка генерации/сохранения изображения: {image_path} ({errors['image']})")
         return None, None
 
+    description = results.get("description", "")
+    metadata = results.get("metadata")
+    if metadata is None:
+        # картинка уже оплачена — не выбрасываем её из-за текста
+        print(f"⚠ Ошибка генерации метаданных: {board_name} ({errors['metadata']}), использую локальные")
+        metadata = pin_metadata.fallback_metadata(board_name, description)
+
+    # 4. Сохранение
     try:
-        with open(json_path, "w") as f:
-            json.dump(
-                {
-                    "original_description": description,
-                    "metadata": metadata,
+        checkpoint.atomic_write_json(
+            json_path,
+            {
+                "original_description": description,
+                "metadata": metadata,
+                "metadata_fallback": "metadata" in errors,
+                "generation": {
+                    "mode": mode,
+                    "api_calls": len(api_calls),
+                    "elapsed_sec": round(time.monotonic() - started, 2),
                 },
-                f,
-                indent=2,
-                ensure_ascii=False,
-            )
+            },
+        )
     except Exception as e:
         print(f"❌ Ошибка сохранения метаданных: {json_path} ({e})")
         return img_path, None
+    manifest.update(index, "saved")
 
     print("✔ Новая картинка:", img_path)
     print("✔ Метаданные:", json_path)
@@ -195,7 +348,14 @@ def process_single_image(image_path: str, out_dir: str, board_name: str, index:
 
 # ================== 5) ОБРАБОТКА ВСЕЙ ДОСКИ ==================
 
-def process_board(board_id: str, board_name: str, input_folder: str, output_folder: str, limit=5):
+def process_board(
+    board_id: str,
+    board_name: str,
+    input_folder: str,
+    output_folder: str,
+    limit=5,
+    mode: str = "describe",
+):
     if not os.path.isdir(input_folder):
         raise RuntimeError(f"❌ Папка не найдена: {input_folder}")
 
@@ -204,7 +364,7 @@ def process_board(board_id: str, board_name: str, input_folder: str, output_fold
         if f.lower().endswith((".jpg", ".jpeg", ".png"))
     ])
 
-    files = files[:limit]
+    files = quality_gate.filter_references(input_folder, files)[:limit]
 
     print(f"\n=== ▶ Генерация по доске: {board_name} ({board_id}) ===")
     if not files:
@@ -212,8 +372,11 @@ def process_board(board_id: str, board_name: str, input_folder: str, output_fold
         return
     print("Найдено файлов:", files)
 
+    manifest = checkpoint.BoardManifest(output_folder)
     for i, f in enumerate(files, start=1):
-        process_single_image(os.path.join(input_folder, f), output_folder, board_name, i)
+        process_single_image(
+            os.path.join(input_folder, f), output_folder, board_name, i, mode=mode, manifest=manifest
+        )
 
 
 def list_account_boards(account) -> list[dict]:
@@ -259,6 +422,7 @@ def process_account(account, limit=5):
             input_folder=b["input_dir"],
             output_folder=output_dir,
             limit=limit,
+            mode=accounts.get_generation_mode(account),
         )
 
 
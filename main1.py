@@ -6,10 +6,18 @@ import time
 from typing import Optional
 
 import requests
-from PIL import Image, ImageFont
+from PIL import ImageFont
 import accounts
+import gemini_files
+import pin_metadata
 import prompts
+import quality_gate
+import retry
+import router
 import settings
+import style_store
+import text_overlay
+import transcode
 
 # ================== CONFIG ==================
 
@@ -26,22 +34,16 @@ RATE_LIMIT_SLEEP = (0.6, 1.2)
 
 # ================== RETRY ==================
 
-def retry_call(fn, max_retries=10, base_delay=2, max_delay=30):
-    for attempt in range(1, max_retries + 1):
-        try:
-            return fn()
-        except (requests.exceptions.HTTPError, GeminiEmptyResponse) as e:
-            if attempt == max_retries:
-                print("❌ Retries exhausted")
-                raise
-
-            delay = min(base_delay * (2 ** (attempt - 1)), max_delay)
-            delay += random.uniform(0, 1)
-            print(
-                f"⏳ Gemini unstable ({type(e).__name__}), "
-                f"retry {attempt}/{max_retries} in {delay:.1f}s"
-            )
-            time.sleep(delay)
+def retry_call(fn, model: str = "", max_retries=10, base_delay=2, max_delay=30):
+    return retry.call(
+        fn,
+        provider="gemini",
+        model=model,
+        max_retries=max_retries,
+        base_delay=base_delay,
+        max_delay=max_delay,
+        retry_on=(GeminiEmptyResponse,),
+    )
 
 
 # ================== HTTP ==================
@@ -94,31 +96,114 @@ def _safe_get_parts(resp: dict):
 
 # ================== GEMINI ==================
 
-def gemini_describe_image(image_path: str) -> str:
+STYLE_PROMPT = (
+    "Analyze this Pinterest-style fashion photo and describe ONLY its aesthetic style: "
+    "mood, color palette, textures, fashion style, lighting, framing, background. "
+    "Return 4–6 sentences. Do NOT mention brands or list objects."
+)
+
+PIN_METADATA_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "title": {"type": "STRING"},
+        "description": {"type": "STRING"},
+        "hashtags": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "alt": {"type": "STRING"},
+    },
+    "required": ["title", "description", "hashtags", "alt"],
+}
+
+
+def _image_part(image_path: str) -> dict:
+    if settings.get_setting("gemini_files_api", default=False):
+        try:
+            return gemini_files.file_part(image_path)
+        except Exception as e:
+            print(f"⚠ Gemini Files upload failed, sending inline ({e})")
+
     mime_type = "image/png" if image_path.lower().endswith(".png") else "image/jpeg"
 
     with open(image_path, "rb") as f:
         b64 = base64.b64encode(f.read()).decode()
 
+    return {"inlineData": {"mimeType": mime_type, "data": b64}}
+
+
+def gemini_describe_image(image_path: str) -> str:
     payload = {
         "contents": [{
             "role": "user",
             "parts": [
-                {"inlineData": {"mimeType": mime_type, "data": b64}},
-                {"text": (
-                    "Analyze this Pinterest-style fashion photo and describe ONLY its aesthetic style: "
-                    "mood, color palette, textures, fashion style, lighting, framing, background. "
-                    "Return 4–6 sentences. Do NOT mention brands or list objects."
-                )}
+                _image_part(image_path),
+                {"text": STYLE_PROMPT}
             ]
         }]
     }
 
-    resp = retry_call(lambda: _post_gemini(VISION_MODEL, "generateContent", payload))
+    resp = retry_call(lambda: _post_gemini(VISION_MODEL, "generateContent", payload), model=VISION_MODEL)
     parts = _safe_get_parts(resp)
 
     return " ".join(p["text"] for p in parts if "text" in p).strip()
 
+def gemini_describe_with_metadata(image_path: str, board_name: str, pins: int = 4) -> tuple[str, list[Optional[dict]]]:
+    """
+    Один vision-вызов вместо двух: стиль референса + метаданные для pins пинов
+    (JSON по схеме, без вырезания фигурных скобок из текста).
+    Невалидные метаданные пина — None на его месте: пин получит их
+    обычным отдельным вызовом
+    """
+    payload = {
+        "contents": [{
+            "role": "user",
+            "parts": [
+                _image_part(image_path),
+                {"text": (
+                    f"{STYLE_PROMPT}\n\n"
+                    f"Board: {board_name}\n"
+                    f"Then write Pinterest metadata for {pins} different pins in this style: "
+                    "title (max 60 chars), description (1–2 sentences), "
+                    "10 aesthetic hashtags, alt (1 sentence).\n"
+                    "Return JSON: style (the style description), pins (list of metadata)."
+                )}
+            ]
+        }],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": {
+                "type": "OBJECT",
+                "properties": {
+                    "style": {"type": "STRING"},
+                    "pins": {
+                        "type": "ARRAY",
+                        "items": PIN_METADATA_SCHEMA,
+                        "minItems": pins,
+                        "maxItems": pins,
+                    },
+                },
+                "required": ["style", "pins"],
+            },
+        },
+    }
+
+    resp = retry_call(lambda: _post_gemini(VISION_MODEL, "generateContent", payload), model=VISION_MODEL)
+    parts = _safe_get_parts(resp)
+
+    data = json.loads("".join(p["text"] for p in parts if "text" in p))
+    if not isinstance(data, dict):
+        raise GeminiEmptyResponse("Gemini returned non-object JSON")
+    style = data.get("style")
+    if not isinstance(style, str) or not style.strip():
+        raise GeminiEmptyResponse("Gemini returned empty style")
+    raw_pins = data.get("pins") if isinstance(data.get("pins"), list) else []
+    metas = []
+    for m in raw_pins[:pins]:
+        try:
+            metas.append(pin_metadata.normalize_metadata(m))
+        except (pin_metadata.InvalidMetadata, AttributeError, TypeError) as e:
+            print(f"⚠ Невалидные метаданные пина в fused-ответе, будут отдельным вызовом: {e}")
+            metas.append(None)
+    return style.strip(), metas
+
 def gemini_generate_similar_image(style_description: str) -> bytes:
     payload = {
         "contents": [{
@@ -135,7 +220,106 @@ def gemini_generate_similar_image(style_description: str) -> bytes:
         }
     }
 
-    resp = retry_call(lambda: _post_gemini(IMAGE_MODEL, "generateContent", payload, 120))
+    resp = retry_call(lambda: _post_gemini(IMAGE_MODEL, "generateContent", payload, 120), model=IMAGE_MODEL)
+    parts = _safe_get_parts(resp)
+
+    for p in parts:
+        if "inlineData" in p:
+            return base64.b64decode(p["inlineData"]["data"])
+
+    raise RuntimeError("❌ Image not found in Gemini response")
+
+def _candidate_images(resp: dict) -> list[bytes]:
+    images = []
+    for cand in resp.get("candidates") or []:
+        for p in (cand.get("content") or {}).get("parts") or []:
+            if "inlineData" in p:
+                images.append(base64.b64decode(p["inlineData"]["data"]))
+                break
+    return images
+
+def gemini_generate_similar_images(style_description: str, n: int) -> list[bytes]:
+    """
+    n картинок по одному стилю: один запрос с candidateCount, а если модель
+    его не поддерживает или вернула меньше — добор отдельными вызовами
+    """
+    images = []
+    if n > 1:
+        payload = {
+            "contents": [{
+                "parts": [{
+                    "text": prompts.render_prompt(
+                        "gemini_image_prompt",
+                        style_description=style_description,
+                    )
+                }]
+            }],
+            "generationConfig": {
+                "responseModalities": ["IMAGE"],
+                "imageConfig": {"aspectRatio": "1:1"},
+                "candidateCount": n,
+            }
+        }
+        try:
+            resp = retry_call(
+                lambda: _post_gemini(IMAGE_MODEL, "generateContent", payload, 120),
+                model=IMAGE_MODEL,
+            )
+            images = _candidate_images(resp)[:n]
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 400:
+                raise
+            print("⚠ candidateCount not supported, falling back to single calls")
+
+    while len(images) < n:
+        images.append(gemini_generate_similar_image(style_description))
+    return images
+
+def pregenerate_pin_images(style_description: str, out_dir: str, indices: list[int]) -> dict[int, bytes]:
+    """
+    Картинки для ещё не сгенерированных пинов доски пачками по
+    image_candidates_per_call; {} если пакетный режим выключен
+    """
+    per_call = int(settings.get_setting("image_candidates_per_call", default=1))
+    ext = transcode.output_ext()
+    missing = [i for i in indices if not os.path.exists(os.path.join(out_dir, f"{i}{ext}"))]
+    if per_call <= 1 or len(missing) <= 1:
+        return {}
+
+    result = {}
+    for start in range(0, len(missing), per_call):
+        chunk = missing[start:start + per_call]
+        try:
+            if settings.get_setting("hedge_image_generation", default=False):
+                images = router.generate_images_hedged(style_description, len(chunk))
+            else:
+                images = gemini_generate_similar_images(style_description, len(chunk))
+        except Exception as e:
+            print(f"❌ Ошибка пакетной генерации ({len(chunk)} шт.): {e}")
+            continue
+        result.update(zip(chunk, images))
+    print(f"✔ Batch generated {len(result)}/{len(missing)} images")
+    return result
+
+def gemini_restyle_image(image_path: str) -> bytes:
+    """
+    Image-to-image: референс уходит прямо в IMAGE_MODEL вместе с промптом,
+    без промежуточного текстового описания
+    """
+    payload = {
+        "contents": [{
+            "parts": [
+                _image_part(image_path),
+                {"text": prompts.render_prompt("gemini_restyle_prompt")},
+            ]
+        }],
+        "generationConfig": {
+            "responseModalities": ["IMAGE"],
+            "imageConfig": {"aspectRatio": "1:1"}
+        }
+    }
+
+    resp = retry_call(lambda: _post_gemini(IMAGE_MODEL, "generateContent", payload, 120), model=IMAGE_MODEL)
     parts = _safe_get_parts(resp)
 
     for p in parts:
@@ -161,7 +345,8 @@ def gemini_generate_promo_image(style_description: str) -> bytes:
     }
 
     resp = retry_call(
-        lambda: _post_gemini(IMAGE_MODEL, "generateContent", payload, 120)
+        lambda: _post_gemini(IMAGE_MODEL, "generateContent", payload, 120),
+        model=IMAGE_MODEL,
     )
     parts = _safe_get_parts(resp)
 
@@ -182,19 +367,22 @@ Board: {board_name}
 Style:
 {style_description}
 
-Return valid JSON with:
-title, description, hashtags (list), alt
+Return Pinterest pin metadata:
+title (max 60 chars), description (1–2 sentences), hashtags (list), alt
 """
             }]
-        }]
+        }],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": PIN_METADATA_SCHEMA,
+        },
     }
 
-    resp = retry_call(lambda: _post_gemini(VISION_MODEL, "generateContent", payload))
+    resp = retry_call(lambda: _post_gemini(VISION_MODEL, "generateContent", payload), model=VISION_MODEL)
     parts = _safe_get_parts(resp)
 
-    raw = " ".join(p["text"] for p in parts if "text" in p)
-    start, end = raw.find("{"), raw.rfind("}")
-    return json.loads(raw[start:end + 1])
+    raw = "".join(p["text"] for p in parts if "text" in p)
+    return pin_metadata.normalize_metadata(json.loads(raw))
 
 def build_promo_metadata(board_name: str, promo_url: str) -> dict:
     return {
@@ -222,11 +410,14 @@ def process_single_image(
     out_dir: str,
     board_name: str,
     index: int,
-    base_style: Optional[str] = None
+    base_style: Optional[str] = None,
+    metadata: Optional[dict] = None,
+    mode: str = "describe",
+    image: Optional[bytes] = None,
 ):
     os.makedirs(out_dir, exist_ok=True)
 
-    img_path = os.path.join(out_dir, f"{index}.jpg")
+    img_path = os.path.join(out_dir, f"{index}{transcode.output_ext()}")
     json_path = os.path.join(out_dir, f"{index}.json")
 
     try:
@@ -235,24 +426,39 @@ def process_single_image(
         print(f"❌ Ошибка описания изображения: {image_path} ({e})")
         return
 
+    generation = None
     if not os.path.exists(img_path):
+        started = time.monotonic()
         try:
-            img = gemini_generate_similar_image(style)
+            if image is not None:
+                img = image
+            elif mode == "image_to_image":
+                img = gemini_restyle_image(image_path)
+            elif settings.get_setting("hedge_image_generation", default=False):
+                img = router.generate_image_hedged(style)
+            else:
+                img = gemini_generate_similar_image(style)
+            transcode.save_generated(img, img_path)
         except Exception as e:
             print(f"❌ Ошибка генерации изображения: {image_path} ({e})")
             return
-        with open(img_path, "wb") as f:
-            f.write(img)
-        print(f"✔ Image {index} generated")
+        generation = {"mode": mode, "image_sec": round(time.monotonic() - started, 2)}
+        print(f"✔ Image {index} generated ({mode}, {generation['image_sec']}s)")
 
     if not os.path.exists(json_path):
+        fallback = False
         try:
-            meta = gemini_generate_metadata(board_name, style)
+            meta = metadata or gemini_generate_metadata(board_name, style)
         except Exception as e:
-            print(f"❌ Ошибка генерации метаданных: {board_name} ({e})")
-            return
+            # картинка уже оплачена — не выбрасываем её из-за текста
+            print(f"⚠ Ошибка генерации метаданных: {board_name} ({e}), использую локальные")
+            meta = pin_metadata.fallback_metadata(board_name, style)
+            fallback = True
         with open(json_path, "w") as f:
-            json.dump({"style": style, "metadata": meta}, f, indent=2, ensure_ascii=False)
+            record = {"style": style, "metadata": meta, "metadata_fallback": fallback}
+            if generation:
+                record["generation"] = generation
+            json.dump(record, f, indent=2, ensure_ascii=False)
         print(f"✔ Metadata {index} generated")
 
 
@@ -266,87 +472,59 @@ def overlay_text_block(
     """
     Вставляет готовую текстовую картинку на промо-пин
     """
+    text_overlay.composite_file(background_path, text_block_path, output_path, position, scale)
 
-    bg = Image.open(background_path).convert("RGBA")
-    txt = Image.open(text_block_path).convert("RGBA")
 
-    BW, BH = bg.size
-
-    # --- масштаб ---
-    new_w = int(BW * scale)
-    ratio = new_w / txt.width
-    new_h = int(txt.height * ratio)
-    txt = txt.resize((new_w, new_h), Image.LANCZOS)
-
-    # --- позиция ---
-    if position == "top":
-        x = (BW - new_w) // 2
-        y = int(BH*0.001)
-    elif position == "center":
-        x = (BW - new_w) // 2
-        y = (BH - new_h) // 2
-    else:
-        raise ValueError("position must be top or center")
-
-    bg.alpha_composite(txt, (x, y))
-    bg.convert("RGB").save(output_path, quality=95)
-
-def process_board(
-    board_id: str,
+def prepare_board(
     board_name: str,
     input_dir: str,
-    output_dir: str,
-    limit: int = 5,
-):
-
-    os.makedirs(output_dir, exist_ok=True)
-
-    files = sorted(
-        f for f in os.listdir(input_dir)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    )[:limit]
+    files: list[str],
+    fused: Optional[bool] = None,
+) -> tuple[Optional[str], list[dict]]:
+    """
+    base_style доски (из style_store или из референса) и, в fused-режиме,
+    метаданные обычных пинов, полученные тем же вызовом
+    """
+    if fused is None:
+        fused = bool(settings.get_setting("gemini_fused_style", default=False))
+
+    def _describe(source_path: str):
+        if fused:
+            try:
+                return gemini_describe_with_metadata(source_path, board_name, pins=min(4, len(files)))
+            except (ValueError, KeyError, GeminiEmptyResponse) as e:
+                # Ответ не разобрался — обычные два шага: описание, затем метаданные по пинам
+                print(f"⚠ Fused-ответ не разобран ({e}), описываю отдельно")
+        return gemini_describe_image(source_path), []
 
-    print(f"\n=== ▶ {board_name} ({board_id}) ({len(files)} files) ===")
-    if not files:
-        print(f"⚠ Нет референсов для {board_name} ({board_id}), пропускаю")
-        return
+    try:
+        record, pin_metas = style_store.get_or_create(input_dir, files, _describe, model=VISION_MODEL)
+    except Exception as e:
+        print(f"❌ Ошибка base_style для {board_name}: {e}")
+        return None, []
+    return record["style"], pin_metas or []
 
-    # --------------------------------------------------
-    # 1️⃣ BASE STYLE (CACHE)
-    # --------------------------------------------------
-    style_cache_path = os.path.join(output_dir, "_base_style.txt")
 
-    if os.path.exists(style_cache_path):
-        with open(style_cache_path, "r", encoding="utf-8") as f:
-            base_style = f.read().strip()
-        print("⏭ base_style loaded from cache")
-    else:
-        try:
-            base_style = gemini_describe_image(os.path.join(input_dir, files[0]))
-        except Exception as e:
-            print(f"❌ Ошибка base_style для {board_name}: {e}")
-            return
-        with open(style_cache_path, "w", encoding="utf-8") as f:
-            f.write(base_style)
-        print("✔ base_style cached")
+def promo_text_layer(promo_text: Optional[str] = None) -> str:
+    """
+    PNG текстового слоя промо-пина: рендер из promo_text (аргумент или
+    настройка), иначе ручной text_layer.png
+    """
+    text = promo_text or settings.get_setting("promo_text")
+    if not text:
+        return "text_layer.png"
+    return text_overlay.render_text_layer_file(
+        text,
+        font_path=settings.get_setting("ffmpeg_font_path") or None,
+        font_size=int(settings.get_setting("promo_font_size", default=96)),
+        color=settings.get_setting("promo_font_color", default="white"),
+        stroke_width=int(settings.get_setting("promo_stroke_width", default=0)),
+    )
 
-    # --------------------------------------------------
-    # 2️⃣ 4 Обычных пина
-    # --------------------------------------------------
-    for i, filename in enumerate(files[:4], start=1):
-        process_single_image(
-            image_path=os.path.join(input_dir, filename),
-            out_dir=output_dir,
-            board_name=board_name,
-            index=i,
-            base_style=base_style,
-        )
 
-    # --------------------------------------------------
-    # 3️⃣ PROMO PIN (BACKGROUND → TEXT OVERLAY)
-    # --------------------------------------------------
+def process_promo_pin(board_name: str, output_dir: str, base_style: str, promo_text: Optional[str] = None):
     promo_raw_path = os.path.join(output_dir, "promo_raw.jpg")
-    promo_final_path = os.path.join(output_dir, "5.jpg")
+    promo_final_path = os.path.join(output_dir, f"5{transcode.output_ext()}")
     promo_json_path = os.path.join(output_dir, "5.json")
 
     # --- 3.1 Генерация фона (без текста) ---
@@ -367,7 +545,7 @@ def process_board(
     try:
         overlay_text_block(
             background_path=promo_raw_path,
-            text_block_path="text_layer.png",
+            text_block_path=promo_text_layer(promo_text),
             output_path=promo_final_path,
             position="top",
             scale=0.6,
@@ -376,7 +554,7 @@ def process_board(
         print(f"❌ Ошибка наложения текста: {board_name} ({e})")
         return
 
-    print("✔ 5.jpg generated")
+    print(f"✔ {os.path.basename(promo_final_path)} generated")
 
     # --------------------------------------------------
     # 4️⃣ PROMO METADATA (LINK В ТЕКСТЕ)
@@ -398,6 +576,65 @@ def process_board(
         print(f"❌ Ошибка удаления promo_raw: {promo_raw_path} ({e})")
 
 
+def list_board_files(input_dir: str, limit: int = 5) -> list[str]:
+    files = sorted(
+        f for f in os.listdir(input_dir)
+        if f.lower().endswith((".jpg", ".jpeg", ".png"))
+    )
+    return quality_gate.filter_references(input_dir, files)[:limit]
+
+
+def process_board(
+    board_id: str,
+    board_name: str,
+    input_dir: str,
+    output_dir: str,
+    limit: int = 5,
+    mode: str = "describe",
+):
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    files = list_board_files(input_dir, limit)
+
+    print(f"\n=== ▶ {board_name} ({board_id}) ({len(files)} files) ===")
+    if not files:
+        print(f"⚠ Нет референсов для {board_name} ({board_id}), пропускаю")
+        return
+
+    # --------------------------------------------------
+    # 1️⃣ BASE STYLE (CACHE)
+    # --------------------------------------------------
+    base_style, pin_metas = prepare_board(board_name, input_dir, files)
+    if base_style is None:
+        return
+
+    # --------------------------------------------------
+    # 2️⃣ 4 Обычных пина
+    # --------------------------------------------------
+    regular = files[:4]
+    batch = {}
+    if mode == "describe":
+        batch = pregenerate_pin_images(base_style, output_dir, list(range(1, len(regular) + 1)))
+
+    for i, filename in enumerate(regular, start=1):
+        process_single_image(
+            image_path=os.path.join(input_dir, filename),
+            out_dir=output_dir,
+            board_name=board_name,
+            index=i,
+            base_style=base_style,
+            metadata=pin_metas[i - 1] if i <= len(pin_metas) else None,
+            mode=mode,
+            image=batch.get(i),
+        )
+
+    # --------------------------------------------------
+    # 3️⃣ PROMO PIN (BACKGROUND → TEXT OVERLAY)
+    # --------------------------------------------------
+    process_promo_pin(board_name, output_dir, base_style)
+
+
 def list_account_boards(account) -> list[dict]:
     base_dir = os.path.join("boards", account["alias"])
     if not os.path.isdir(base_dir):
@@ -441,6 +678,7 @@ def process_account(account, limit: int = 5):
             input_dir=b["input_dir"],
             output_dir=output_dir,
             limit=limit,
+            mode=accounts.get_generation_mode(account),
         )
 
 # ================== RUN ==================
@@ -1,17 +1,49 @@
 import base64
+import functools
 import os
 import time
 import requests
 import subprocess
+import threading
 import json
 
 import settings
+import encode_pool
+import kenburns
 import main1
+import media_hosting
+import pin_metadata
+import poll_schedule
+import quality_gate
+import retry
+import style_store
+import text_overlay
+import transcode
+import video_cover
+import video_tasks
+import webhook
 
 # ================== CONFIG ==================
 
 FREEPIK_API_KEY = settings.get_setting("freepik_api_key", env_var="FREEPIK_API_KEY") or ""
 FREEPIK_BASE_URL = "https://api.freepik.com/v1/ai/image-to-video/kling-v2-5-pro"
+FREEPIK_MODEL = FREEPIK_BASE_URL.rsplit("/", 1)[-1]
+
+VIDEO_PROMPT = (
+    "subtle motion, slow camera zoom, gentle parallax, "
+    "soft cinematic lighting; no text, no logos"
+)
+VIDEO_NEGATIVE = "text, logos, distorted text, heavy motion"
+PROMO_PROMPT = (
+    "subtle motion, slow camera zoom, gentle parallax, soft cinematic lighting; "
+    "no text, no logos, clean empty space at top for text overlay"
+)
+PROMO_NEGATIVE = "text, logos, distorted text, unreadable letters, blurry text, heavy motion, extra text"
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# Начало mp4 для пробы порядка box'ов (ftyp + заголовок moov/mdat)
+MP4_PROBE_BYTES = 64 * 1024
+_DOWNLOAD_SLOTS = threading.BoundedSemaphore(int(settings.get_setting("video_download_concurrency", default=3)))
 
 
 # ================== UTILS ==================
@@ -51,16 +83,25 @@ def create_video_task(
     if webhook_url:
         payload["webhook_url"] = webhook_url
 
-    r = requests.post(FREEPIK_BASE_URL, headers=freepik_headers(), json=payload, timeout=60)
-    r.raise_for_status()
-    return r.json()
+    def _do():
+        r = requests.post(FREEPIK_BASE_URL, headers=freepik_headers(), json=payload, timeout=60)
+        r.raise_for_status()
+        return r.json()
+
+    # Повтор после таймаута или 5xx мог бы создать вторую платную задачу —
+    # повторяем только 429 и ошибки соединения
+    return retry.call(_do, provider="freepik", model=FREEPIK_MODEL, retry_statuses={429}, idempotent=False)
 
 
 def get_task_status(task_id: str) -> dict:
     url = f"{FREEPIK_BASE_URL}/{task_id}"
-    r = requests.get(url, headers=freepik_headers(), timeout=60)
-    r.raise_for_status()
-    return r.json()
+
+    def _do():
+        r = requests.get(url, headers=freepik_headers(), timeout=60)
+        r.raise_for_status()
+        return r.json()
+
+    return retry.call(_do, provider="freepik", model=FREEPIK_MODEL)
 
 
 def extract_video_url(resp: dict) -> str | None:
@@ -83,86 +124,343 @@ def extract_video_url(resp: dict) -> str | None:
     return None
 
 
-def wait_for_completion(task_id: str, timeout_sec: int = 900, poll_interval: int = 5) -> dict:
+def wait_for_completion(task_id: str, timeout_sec: int = 900, duration: str = "5", status_fn=None) -> dict:
+    # Статус запрашивается по расписанию из истории длительностей задач.
+    # С webhook опрос — редкий запасной вариант: ждём уведомления,
+    # затем один раз берём статус из API (тело webhook не проверяется).
+    # status_fn — замена get_task_status (providers: запрос под семафором freepik)
+    status_fn = status_fn or get_task_status
+    schedule = poll_schedule.PollSchedule(FREEPIK_MODEL, duration)
     started = time.time()
-    while time.time() - started < timeout_sec:
-        resp = get_task_status(task_id)
-        status = (resp.get("data") or {}).get("status")
-        if status in ("COMPLETED", "FAILED"):
-            return resp
-        time.sleep(poll_interval)
+    woken = False
+    try:
+        while True:
+            elapsed = time.time() - started
+            if elapsed >= timeout_sec:
+                break
+            # После webhook, за которым задача оказалась не готова, следующий
+            # запрос — по расписанию: поток POST не превращается в поток запросов
+            if webhook.active() and not woken:
+                woken = bool(webhook.wait_for({task_id}, timeout=min(webhook.fallback_poll_sec(), timeout_sec - elapsed)))
+                webhook.forget(task_id)
+            else:
+                time.sleep(min(schedule.next_delay(elapsed), timeout_sec - elapsed))
+                webhook.forget(task_id)
+                woken = False
+
+            resp = status_fn(task_id)
+            schedule.polled()
+            status = (resp.get("data") or {}).get("status")
+            if status in ("COMPLETED", "FAILED"):
+                schedule.finish(task_id, time.time() - started, completed=status == "COMPLETED")
+                return resp
+    finally:
+        webhook.forget(task_id)
+    schedule.finish(task_id, time.time() - started, completed=False)
     raise TimeoutError(f"Task timed out: {task_id}")
 
 
+class IncompleteDownload(Exception):
+    pass
+
+
+def _content_total(r: requests.Response, offset: int) -> int | None:
+    # 206: "bytes 100-999/1000"; 416: "bytes */1000"; 200: Content-Length всего файла
+    content_range = r.headers.get("Content-Range", "")
+    if r.status_code in (206, 416) and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    if r.status_code == 416:
+        return None
+    length = r.headers.get("Content-Length")
+    if length and length.isdigit():
+        return int(length) + (offset if r.status_code == 206 else 0)
+    return None
+
+
 def download_video(video_url: str, out_path: str) -> None:
-    r = requests.get(video_url, timeout=120)
-    r.raise_for_status()
-    with open(out_path, "wb") as f:
-        f.write(r.content)
+    """
+    Потоковое скачивание в out_path.part кусками; после обрыва докачка
+    с места остановки через Range, размер сверяется с Content-Length,
+    готовый файл fsync + атомарный rename. Одновременно качается
+    не больше video_download_concurrency файлов.
+    """
+    part_path = f"{out_path}.part"
+    url_path = f"{part_path}.url"
+
+    # Недокачанный файл от другой задачи (другой URL) не продолжаем
+    if os.path.exists(part_path):
+        try:
+            with open(url_path, "r", encoding="utf-8") as f:
+                same_source = f.read() == video_url
+        except OSError:
+            same_source = False
+        if not same_source:
+            os.remove(part_path)
+    with open(url_path, "w", encoding="utf-8") as f:
+        f.write(video_url)
+
+    def _do():
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with requests.get(video_url, headers=headers, stream=True, timeout=(10, 60)) as r:
+            if r.status_code == 416:
+                total = _content_total(r, offset)
+                if total == offset:
+                    # Уже скачано целиком в прошлый раз
+                    return
+                # .part длиннее файла на CDN или размер неизвестен — качаем заново
+                os.remove(part_path)
+                raise IncompleteDownload(f"416 at {offset}/{total} bytes, restarting: {video_url}")
+            r.raise_for_status()
+            if r.status_code != 206:
+                offset = 0
+            total = _content_total(r, offset)
+            with open(part_path, "ab" if offset else "wb") as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            raise IncompleteDownload(f"{size}/{total} bytes: {video_url}")
+
+    with _DOWNLOAD_SLOTS:
+        retry.call(
+            _do,
+            provider="freepik-cdn",
+            retry_on=(IncompleteDownload, requests.exceptions.ChunkedEncodingError),
+        )
+    os.replace(part_path, out_path)
+    os.remove(url_path)
+
+
+def _encode_args() -> list[str]:
+    # H.264 под Pinterest: yuv420p, moov в начале файла для быстрого старта
+    return [
+        "-c:v",
+        "libx264",
+        "-preset",
+        str(settings.get_setting("video_x264_preset", default="medium")),
+        "-crf",
+        str(settings.get_setting("video_crf", default=20)),
+        "-pix_fmt",
+        "yuv420p",
+        "-movflags",
+        "+faststart",
+        "-c:a",
+        "copy",
+        "-threads",
+        str(encode_pool.threads_per_worker()),
+    ]
 
 
-def overlay_text_on_video(
-    input_mp4: str,
-    output_mp4: str,
+def _text_layer(
     text: str,
     font_path: str | None = None,
     font_size: int = 64,
     font_color: str = "white",
     box: bool = True,
     box_color: str = "black@0.35",
-    x: str = "(w-text_w)/2",
-    y: str = "h*0.08",
-):
-    font_arg = f":fontfile={font_path}" if font_path else ""
-    drawtext = (
-        f"drawtext=text='{text}':fontsize={font_size}:fontcolor={font_color}"
-        f"{font_arg}:x={x}:y={y}"
+) -> str:
+    return text_overlay.render_text_layer_file(
+        text,
+        font_path=font_path,
+        font_size=font_size,
+        color=font_color,
+        box_color=box_color if box else None,
+        padding=12 if box else 10,
     )
-    if box:
-        drawtext += f":box=1:boxcolor={box_color}:boxborderw=12"
 
-    cmd = [
+
+def _overlay_cmd(
+    input_mp4: str,
+    layer_path: str,
+    output_mp4: str,
+    x: str,
+    y: str,
+    cover_for: str | None = None,
+) -> list[str]:
+    graph = f"[0:v][1:v]overlay=x={x}:y={y}"
+    maps, cover_outputs = [], []
+    if cover_for:
+        # Обложка для итогового cover_for — в том же проходе
+        graph = f"{graph}[ov];{video_cover.graph('ov')}"
+        maps = ["-map", "[vout]", "-map", "0:a?"]
+        cover_outputs = video_cover.output_args(cover_for)
+    return [
         "ffmpeg",
         "-y",
+        "-loglevel",
+        "error",
         "-i",
         input_mp4,
-        "-vf",
-        drawtext,
-        "-codec:a",
-        "copy",
+        "-i",
+        layer_path,
+        "-filter_complex",
+        graph,
+        *maps,
+        *_encode_args(),
         output_mp4,
+        *cover_outputs,
     ]
-    subprocess.run(cmd, check=True)
+
+
+def overlay_text_on_video(
+    input_mp4: str,
+    output_mp4: str,
+    text: str,
+    font_path: str | None = None,
+    font_size: int = 64,
+    font_color: str = "white",
+    box: bool = True,
+    box_color: str = "black@0.35",
+    x: str = "(W-w)/2",
+    y: str = "H*0.08",
+    cover_for: str | None = None,
+):
+    """
+    Текст рисуется заранее в PNG (text_overlay, с кэшем) и накладывается
+    фильтром overlay; x/y — выражения overlay (W/H — видео, w/h — слой).
+    cover_for — видео, рядом с которым положить обложку
+    """
+    layer_path = _text_layer(text, font_path, font_size, font_color, box, box_color)
+    encode_pool.run(_overlay_cmd(input_mp4, layer_path, output_mp4, x, y, cover_for), label=os.path.basename(output_mp4))
+
+
+def _moov_first(head: bytes) -> bool | None:
+    """
+    Порядок верхних box'ов MP4 по началу файла: True — moov до mdat
+    (faststart, можно читать из потока), False — mdat раньше, None — не видно
+    """
+    pos = 0
+    while pos + 8 <= len(head):
+        size = int.from_bytes(head[pos:pos + 4], "big")
+        box = head[pos + 4:pos + 8]
+        if box == b"moov":
+            return True
+        if box == b"mdat":
+            return False
+        if size == 1:
+            if pos + 16 > len(head):
+                return None
+            size = int.from_bytes(head[pos + 8:pos + 16], "big")
+        if size < 8:
+            return None
+        pos += size
+    return None
+
+
+def _streamable(video_url: str) -> bool:
+    """
+    Дешёвая проба Range на первые MP4_PROBE_BYTES: при moov в конце ffmpeg
+    прочитал бы из потока весь файл и всё равно упал
+    """
+    head = b""
+    try:
+        with requests.get(
+            video_url, headers={"Range": f"bytes=0-{MP4_PROBE_BYTES - 1}"}, stream=True, timeout=(10, 30)
+        ) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=MP4_PROBE_BYTES):
+                head += chunk
+                if len(head) >= MP4_PROBE_BYTES:
+                    break
+    except requests.exceptions.RequestException as e:
+        print(f"⚠ Проба видео не удалась ({e})")
+        return False
+    return bool(_moov_first(head[:MP4_PROBE_BYTES]))
+
+
+def stream_overlay_video(
+    video_url: str,
+    output_mp4: str,
+    text: str,
+    font_path: str | None = None,
+    font_size: int = 64,
+    font_color: str = "white",
+    box: bool = True,
+    box_color: str = "black@0.35",
+    x: str = "(W-w)/2",
+    y: str = "H*0.08",
+):
+    """
+    Один проход: ответ CDN идёт прямо в stdin ffmpeg, наложение текста
+    и кодирование без промежуточного mp4 на диске. Если по пробе moov
+    в конце файла (из потока не прочитать) или поток оборвался —
+    обычное скачивание с докачкой и наложение из файла.
+    """
+    layer_path = _text_layer(text, font_path, font_size, font_color, box, box_color)
+    encoding_mp4 = f"{output_mp4}.encoding.mp4"
+    cover_for = output_mp4 if video_cover.enabled() else None
+
+    def _feed(stdin):
+        with requests.get(video_url, stream=True, timeout=(10, 60)) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                stdin.write(chunk)
+
+    if not _streamable(video_url):
+        print(f"⏬ moov не в начале файла, скачиваю перед наложением: {os.path.basename(output_mp4)}")
+    else:
+        try:
+            with _DOWNLOAD_SLOTS:
+                encode_pool.run(
+                    _overlay_cmd("pipe:0", layer_path, encoding_mp4, x, y, cover_for),
+                    label=os.path.basename(output_mp4),
+                    feed=_feed,
+                )
+            os.replace(encoding_mp4, output_mp4)
+            return
+        except (OSError, subprocess.CalledProcessError, requests.exceptions.RequestException) as e:
+            print(f"⚠ Потоковая обработка не удалась ({e}), скачиваю файл")
+            if os.path.exists(encoding_mp4):
+                os.remove(encoding_mp4)
+
+    src_mp4 = f"{output_mp4}.src.mp4"
+    download_video(video_url, src_mp4)
+    overlay_text_on_video(src_mp4, encoding_mp4, text, font_path, font_size, font_color, box, box_color, x, y, cover_for)
+    os.replace(encoding_mp4, output_mp4)
+    os.remove(src_mp4)
 
 
 # ================== PIPELINE ==================
 
-def animate_pin(
+def submit_video_task(
     image_path_or_url: str,
-    out_mp4: str,
     prompt: str,
     negative_prompt: str = "",
     duration: str = "5",
     cfg_scale: float = 0.5,
     webhook_url: str | None = None,
-):
+    account_alias: str | None = None,
+) -> str:
     if not FREEPIK_API_KEY:
         raise RuntimeError("Freepik API key not set (freepik_api_key)")
 
+    # Локальный файл по возможности уходит ссылкой (Late media), а не base64
     task = create_video_task(
-        image_path_or_url=image_path_or_url,
+        image_path_or_url=media_hosting.video_source(account_alias, image_path_or_url),
         prompt=prompt,
         negative_prompt=negative_prompt,
         duration=duration,
         cfg_scale=cfg_scale,
-        webhook_url=webhook_url,
+        webhook_url=webhook_url or webhook.callback_url(),
     )
     task_id = (task.get("data") or {}).get("task_id")
     if not task_id:
         raise RuntimeError(f"Task id not found: {task}")
 
     print(f"🟡 Task created: {task_id}")
-    result = wait_for_completion(task_id)
+    return task_id
+
+
+def complete_video_task(result: dict, out_mp4: str, overlay: dict | None = None) -> None:
+    """
+    Скачивает готовое видео; с overlay (text + параметры
+    stream_overlay_video) текст накладывается в том же проходе
+    """
     status = (result.get("data") or {}).get("status")
     if status != "COMPLETED":
         raise RuntimeError(f"Task failed: {result}")
@@ -172,83 +470,115 @@ def animate_pin(
         raise RuntimeError(f"Video URL not found: {result}")
 
     os.makedirs(os.path.dirname(out_mp4) or ".", exist_ok=True)
-    download_video(video_url, out_mp4)
+    if overlay:
+        stream_overlay_video(video_url, out_mp4, **overlay)
+    else:
+        download_video(video_url, out_mp4)
+        if video_cover.enabled():
+            try:
+                video_cover.extract(out_mp4)
+            except Exception as e:
+                print(f"⚠ Обложка не извлечена: {out_mp4} ({e})")
     print(f"✅ Done: {out_mp4}")
 
 
-def load_board_style(account_alias: str, board_id: str) -> str:
-    style_path = os.path.join("generated_gemini", account_alias, board_id, "_base_style.txt")
-    if os.path.isfile(style_path):
-        with open(style_path, "r", encoding="utf-8") as f:
-            return f.read().strip()
+# ================== LOCAL ENGINE ==================
 
+def video_engine() -> str:
+    engine = (settings.get_setting("video_engine", default="freepik") or "freepik").lower()
+    if engine not in ("freepik", "local"):
+        raise RuntimeError(f"Unsupported video_engine: {engine}")
+    return engine
+
+
+def render_local_video(image_path: str, out_mp4: str, duration: str = "5", overlay: dict | None = None) -> None:
+    """
+    Наезд / панорама / параллакс из картинки локально (kenburns, ffmpeg)
+    вместо задачи Freepik; overlay — как в complete_video_task
+    """
+    os.makedirs(os.path.dirname(out_mp4) or ".", exist_ok=True)
+    encoding_mp4 = f"{out_mp4}.encoding.mp4"
+    parallax_path = None
+    if settings.get_setting("video_local_parallax", default=True):
+        parallax_path = kenburns.parallax_layer(image_path, f"{out_mp4}.fg.png")
+
+    text_layer_path = None
+    text_x, text_y = "(W-w)/2", "H*0.08"
+    if overlay:
+        style = dict(overlay)
+        text_x = style.pop("x", text_x)
+        text_y = style.pop("y", text_y)
+        text_layer_path = _text_layer(style.pop("text"), **style)
+
+    try:
+        encode_pool.run(
+            kenburns.build_command(
+                image_path,
+                encoding_mp4,
+                float(duration),
+                _encode_args(),
+                parallax_path=parallax_path,
+                text_layer_path=text_layer_path,
+                text_x=text_x,
+                text_y=text_y,
+                cover_for=out_mp4 if video_cover.enabled() else None,
+            ),
+            label=os.path.basename(out_mp4),
+        )
+        os.replace(encoding_mp4, out_mp4)
+    finally:
+        for path in (parallax_path, encoding_mp4):
+            if path and os.path.exists(path):
+                os.remove(path)
+    print(f"✅ Done (local): {out_mp4}")
+
+
+def load_board_style(account_alias: str, board_id: str, files: list[str] | None = None) -> str:
+    """
+    files — уже отфильтрованные референсы доски, чтобы не декодировать
+    и не оценивать их повторно
+    """
     board_dir = os.path.join("boards", account_alias, board_id)
     if not os.path.isdir(board_dir):
         raise RuntimeError(f"Board directory not found: {board_dir}")
 
-    files = [
-        f for f in os.listdir(board_dir)
-        if f.lower().endswith((".jpg", ".jpeg", ".png"))
-    ]
+    if files is None:
+        files = list_reference_files(board_dir)
     if not files:
         raise RuntimeError(f"No reference images found in: {board_dir}")
 
-    style = main1.gemini_describe_image(os.path.join(board_dir, files[0]))
-    os.makedirs(os.path.dirname(style_path), exist_ok=True)
-    with open(style_path, "w", encoding="utf-8") as f:
-        f.write(style)
-    return style
+    record, _ = style_store.get_or_create(
+        board_dir,
+        files,
+        lambda path: (main1.gemini_describe_image(path), None),
+        model=main1.VISION_MODEL,
+    )
+    return record["style"]
 
 
 def generate_clean_promo_image(style_description: str, out_path: str) -> str:
     img = main1.gemini_generate_promo_image(style_description)
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
-    with open(out_path, "wb") as f:
-        f.write(img)
+    transcode.save_generated(img, out_path, fmt="jpeg")
     return out_path
 
 
-def animate_promo_video_from_board(
-    account_alias: str,
-    board_id: str,
-    out_mp4: str,
-    promo_text: str = "Remote work for women",
-    duration: str = "5",
-    cfg_scale: float = 0.9,
-):
-    style = load_board_style(account_alias, board_id)
+def prepare_promo_source(account_alias: str, board_id: str, style: str | None = None) -> str:
+    style = style or load_board_style(account_alias, board_id)
     clean_path = os.path.join("generated_gemini", account_alias, board_id, "promo_clean.jpg")
-    generate_clean_promo_image(style, clean_path)
+    return generate_clean_promo_image(style, clean_path)
 
-    prompt = (
-        "subtle motion, slow camera zoom, gentle parallax, soft cinematic lighting; "
-        "no text, no logos, clean empty space at top for text overlay"
-    )
-    negative = "text, logos, distorted text, unreadable letters, blurry text, heavy motion, extra text"
 
-    tmp_mp4 = f"{out_mp4}.tmp.mp4"
-    animate_pin(
-        image_path_or_url=clean_path,
-        out_mp4=tmp_mp4,
-        prompt=prompt,
-        negative_prompt=negative,
-        duration=duration,
-        cfg_scale=cfg_scale,
-    )
-
-    font_path = settings.get_setting("ffmpeg_font_path") or None
-    overlay_text_on_video(
-        input_mp4=tmp_mp4,
-        output_mp4=out_mp4,
-        text=promo_text,
-        font_path=font_path,
-        font_size=72,
-        font_color="white",
-        box=False,
-        x="(w-text_w)/2",
-        y="h*0.08",
-    )
-    os.remove(tmp_mp4)
+def promo_overlay(promo_text: str) -> dict:
+    return {
+        "text": promo_text,
+        "font_path": settings.get_setting("ffmpeg_font_path") or None,
+        "font_size": 72,
+        "font_color": "white",
+        "box": False,
+        "x": "(W-w)/2",
+        "y": "H*0.08",
+    }
 
 
 def list_account_boards(account_alias: str) -> list[dict]:
@@ -280,6 +610,116 @@ def list_account_boards(account_alias: str) -> list[dict]:
     return boards
 
 
+def write_video_metadata(out_json: str, board_name: str, base_style: str) -> None:
+    if os.path.exists(out_json):
+        return
+    fallback = False
+    try:
+        meta = main1.gemini_generate_metadata(board_name, base_style)
+    except Exception as e:
+        # видео уже оплачено — без JSON оно никогда не опубликуется
+        print(f"⚠ Ошибка генерации метаданных видео: {board_name} ({e}), использую локальные")
+        meta = pin_metadata.fallback_metadata(board_name, base_style)
+        fallback = True
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump({"metadata": meta, "metadata_fallback": fallback}, f, indent=2, ensure_ascii=False)
+
+
+def write_promo_metadata(promo_json: str, board_name: str) -> None:
+    if os.path.exists(promo_json):
+        return
+    promo_url = main1.mutate_url(main1.PROMO_BASE_URL)
+    promo_meta = main1.build_promo_metadata(board_name, promo_url)
+    with open(promo_json, "w", encoding="utf-8") as f:
+        json.dump({"metadata": promo_meta}, f, indent=2, ensure_ascii=False)
+
+
+def list_reference_files(board_dir: str) -> list[str]:
+    files = [
+        f for f in os.listdir(board_dir)
+        if f.lower().endswith((".jpg", ".jpeg", ".png"))
+    ]
+    return quality_gate.filter_references(board_dir, files)
+
+
+def build_board_video_jobs(
+    account_alias: str,
+    board: dict,
+    promo_text: str = "Remote work for women",
+    duration: str = "5",
+    cfg_scale: float = 0.9,
+) -> list[dict]:
+    """
+    Задачи Freepik по доске для video_tasks.run_video_jobs: 4 обычных
+    видео по референсам и промо-видео; готовые .mp4 пропускаются.
+    on_done пишет метаданные / накладывает текст сразу после скачивания.
+    """
+    board_dir = board["dir"]
+    ref_files = list_reference_files(board_dir)
+    if not ref_files:
+        print(f"⚠ Нет референсов для {board['name']} ({board['id']}), пропускаю")
+        return []
+
+    out_dir = os.path.join("generated_videos", account_alias, board["id"])
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 1) Base style for metadata
+    base_style = load_board_style(account_alias, board["id"], ref_files)
+
+    jobs = []
+    # 2) 4 обычных видео по референсам
+    for idx, filename in enumerate(ref_files[:4], start=1):
+        out_mp4 = os.path.join(out_dir, f"{idx}.mp4")
+        out_json = os.path.join(out_dir, f"{idx}.json")
+        on_done = functools.partial(write_video_metadata, out_json, board["name"], base_style)
+        if os.path.exists(out_mp4):
+            # повторный запуск после частичного сбоя: ошибка одного пина не роняет доску
+            try:
+                on_done()
+            except Exception as e:
+                print(f"❌ Ошибка метаданных видео {board['id']}/{idx}: {e}")
+            continue
+        jobs.append(
+            {
+                "label": f"{board['id']}/{idx}",
+                "account_alias": account_alias,
+                "image": os.path.join(board_dir, filename),
+                "prompt": VIDEO_PROMPT,
+                "negative_prompt": VIDEO_NEGATIVE,
+                "duration": duration,
+                "cfg_scale": cfg_scale,
+                "download_path": out_mp4,
+                "on_done": on_done,
+            }
+        )
+
+    # 3) Promo video с текстом
+    promo_video = os.path.join(out_dir, "5.mp4")
+    promo_json = os.path.join(out_dir, "5.json")
+    if os.path.exists(promo_video):
+        try:
+            write_promo_metadata(promo_json, board["name"])
+        except Exception as e:
+            print(f"❌ Ошибка метаданных промо-видео {board['id']}: {e}")
+        return jobs
+
+    jobs.append(
+        {
+            "label": f"{board['id']}/promo",
+            "account_alias": account_alias,
+            "image": prepare_promo_source(account_alias, board["id"], base_style),
+            "prompt": PROMO_PROMPT,
+            "negative_prompt": PROMO_NEGATIVE,
+            "duration": duration,
+            "cfg_scale": cfg_scale,
+            "download_path": promo_video,
+            "overlay": promo_overlay(promo_text),
+            "on_done": functools.partial(write_promo_metadata, promo_json, board["name"]),
+        }
+    )
+    return jobs
+
+
 def process_account_videos(
     account_alias: str,
     promo_text: str = "Remote work for women",
@@ -291,76 +731,37 @@ def process_account_videos(
         print("❌ Boards not found for account:", account_alias)
         return
 
+    jobs = []
     for b in boards:
-        board_dir = b["dir"]
-        ref_files = [
-            f for f in os.listdir(board_dir)
-            if f.lower().endswith((".jpg", ".jpeg", ".png"))
-        ]
-        if not ref_files:
-            print(f"⚠ Нет референсов для {b['name']} ({b['id']}), пропускаю")
-            continue
-
-        out_dir = os.path.join("generated_videos", account_alias, b["id"])
-        os.makedirs(out_dir, exist_ok=True)
+        try:
+            jobs.extend(build_board_video_jobs(account_alias, b, promo_text, duration, cfg_scale))
+        except Exception as e:
+            print(f"❌ Ошибка подготовки видео для {b['name']} ({b['id']}): {e}")
 
-        # 1) Base style for metadata
-        base_style = load_board_style(account_alias, b["id"])
-
-        # 2) 4 обычных видео по референсам
-        for idx, filename in enumerate(ref_files[:4], start=1):
-            src_path = os.path.join(board_dir, filename)
-            out_mp4 = os.path.join(out_dir, f"{idx}.mp4")
-            out_json = os.path.join(out_dir, f"{idx}.json")
-
-            if not os.path.exists(out_mp4):
-                prompt = (
-                    "subtle motion, slow camera zoom, gentle parallax, "
-                    "soft cinematic lighting; no text, no logos"
-                )
-                negative = "text, logos, distorted text, heavy motion"
-                animate_pin(
-                    image_path_or_url=src_path,
-                    out_mp4=out_mp4,
-                    prompt=prompt,
-                    negative_prompt=negative,
-                    duration=duration,
-                    cfg_scale=cfg_scale,
-                )
-
-            if not os.path.exists(out_json):
-                meta = main1.gemini_generate_metadata(b["name"], base_style)
-                with open(out_json, "w", encoding="utf-8") as f:
-                    json.dump({"metadata": meta}, f, indent=2, ensure_ascii=False)
-
-        # 3) Promo video с текстом
-        promo_video = os.path.join(out_dir, "5.mp4")
-        promo_json = os.path.join(out_dir, "5.json")
-        if not os.path.exists(promo_video):
-            animate_promo_video_from_board(
-                account_alias=account_alias,
-                board_id=b["id"],
-                out_mp4=promo_video,
-                promo_text=promo_text,
-                duration=duration,
-                cfg_scale=cfg_scale,
-            )
-
-        if not os.path.exists(promo_json):
-            promo_url = main1.mutate_url(main1.PROMO_BASE_URL)
-            promo_meta = main1.build_promo_metadata(b["name"], promo_url)
-            with open(promo_json, "w", encoding="utf-8") as f:
-                json.dump({"metadata": promo_meta}, f, indent=2, ensure_ascii=False)
+    # Все задачи аккаунта отправляются сразу (в пределах лимита) и
+    # отслеживаются одним циклом опроса
+    if video_engine() == "local":
+        errors = video_tasks.run_local_jobs(jobs)
+    else:
+        errors = video_tasks.run_video_jobs(jobs)
+    for label, err in errors.items():
+        print(f"❌ Видео {label}: {err}")
 
 
 # ================== RUN ==================
 
 if __name__ == "__main__":
-    animate_pin(
-        image_path_or_url="/Users/savage/PycharmProjects/pinterest/boards/Ballet_core/Ballet Clas.jpeg",
-        out_mp4="pin.mp4",
-        prompt="subtle motion, slow camera zoom, gentle parallax, soft cinematic lighting",
-        negative_prompt="text, logos, heavy motion",
-        duration="5",
-        cfg_scale=0.5,
+    import asyncio
+
+    import providers
+
+    asyncio.run(
+        providers.animate_pin(
+            image_path_or_url="/Users/savage/PycharmProjects/pinterest/boards/Ballet_core/Ballet Clas.jpeg",
+            out_mp4="pin.mp4",
+            prompt="subtle motion, slow camera zoom, gentle parallax, soft cinematic lighting",
+            negative_prompt="text, logos, heavy motion",
+            duration="5",
+            cfg_scale=0.5,
+        )
     )
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import time
+
+import accounts
+import proxy
+import settings
+import upload_cache
+
+# ================== CONFIG ==================
+
+CACHE_PATH = os.path.join(os.path.dirname(__file__), "hosted_media_cache.json")
+DEFAULT_TTL_HOURS = 24
+
+_CACHE = upload_cache.UploadCache(CACHE_PATH)
+
+
+def enabled() -> bool:
+    return bool(settings.get_setting("freepik_hosted_media", default=False))
+
+
+def _ttl_sec() -> float:
+    return float(settings.get_setting("hosted_media_ttl_hours", default=DEFAULT_TTL_HOURS)) * 3600
+
+
+# ================== UPLOAD ==================
+
+def hosted_url(account_alias: str, path: str) -> str:
+    """
+    Публичный URL картинки через Late media: загружается один раз
+    на содержимое, дальше берётся из кэша
+    """
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    def _upload() -> dict:
+        url = proxy.late_upload_media(accounts.get_account(account_alias), path)
+        print(f"⬆ Source uploaded for Freepik: {os.path.basename(path)}")
+        return {"url": url, "expires_at": time.time() + _ttl_sec()}
+
+    url = _CACHE.get_or_create(digest, _upload)["url"]
+    return url
+
+
+def video_source(account_alias: str | None, path: str) -> str:
+    """
+    Что отдать Freepik в поле image: URL (если включено и загрузка
+    удалась) или сам путь — тогда main3.encode_image закодирует base64
+    """
+    if not enabled() or not account_alias or path.startswith(("http://", "https://")):
+        return path
+    try:
+        return hosted_url(account_alias, path)
+    except Exception as e:
+        print(f"⚠ Загрузка источника не удалась, отправляю base64: {os.path.basename(path)} ({e})")
+        return path
@@ -11,6 +11,8 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException
 import accounts
+import quality_gate
+import settings
 
 # ======================================================
 # 🔐 CONSTANTS
@@ -462,6 +464,7 @@ def run_bot(account, target_count=5, max_attempts=25, headless=False):
         raise
 
     results = {}
+    gate_enabled = settings.get_setting("reference_quality_gate", default=True)
 
     for b in boards:
         name = b["name"]
@@ -492,17 +495,37 @@ def run_bot(account, target_count=5, max_attempts=25, headless=False):
         with open(os.path.join(out_dir, "board.json"), "w", encoding="utf-8") as f:
             json.dump({"id": board_id, "name": name}, f, ensure_ascii=False, indent=2)
 
+        rejects_path = os.path.join(out_dir, quality_gate.REJECTS_NAME)
+        if os.path.isfile(rejects_path):
+            os.remove(rejects_path)
+
         success_count = 0
         for url in pin_urls:
             if success_count >= target_count:
                 break
 
             try:
-                save_pin_to_board(driver, url, name)
                 img = download_pin_image(driver, url, out_dir, f"{success_count + 1}")
             except Exception as e:
-                print(f"❌ Ошибка сохранения/скачивания пина: {url} ({e})")
+                print(f"❌ Ошибка скачивания пина: {url} ({e})")
                 img = None
+            if img and gate_enabled:
+                ok, reasons, scores = quality_gate.check_image(img)
+                if not ok:
+                    # не тратим API на негодный референс и не сохраняем пин
+                    # на доску — берём следующий
+                    print(f"🚫 Референс отклонён ({', '.join(reasons)}), ищу замену")
+                    quality_gate.record_rejection(out_dir, os.path.basename(img), reasons, scores, source=url)
+                    os.remove(img)
+                    img = None
+            if img:
+                # На доску Pinterest сохраняются только прошедшие проверку пины
+                try:
+                    save_pin_to_board(driver, url, name)
+                except Exception as e:
+                    print(f"❌ Ошибка сохранения пина: {url} ({e})")
+                    os.remove(img)
+                    img = None
             if img:
                 saved.append(img)
                 success_count += 1
@@ -0,0 +1,69 @@
+import re
+
+TITLE_MAX = 100
+DESCRIPTION_MAX = 500
+HASHTAGS_MAX = 20
+
+
+class InvalidMetadata(ValueError):
+    pass
+
+
+def _clean_hashtags(raw) -> list[str]:
+    if isinstance(raw, str):
+        raw = re.split(r"[\s,]+", raw)
+    if not isinstance(raw, list):
+        return []
+
+    tags = []
+    for tag in raw:
+        if not isinstance(tag, str):
+            continue
+        tag = tag.strip().lstrip("#")
+        tag = re.sub(r"\s+", "", tag)
+        if tag and f"#{tag}" not in tags:
+            tags.append(f"#{tag}")
+    return tags[:HASHTAGS_MAX]
+
+
+def normalize_metadata(data) -> dict:
+    """
+    Проверяет и приводит метаданные пина к виду
+    {title, description, hashtags: [#tag], alt}.
+    Принимает pin_description как синоним description.
+    """
+    if not isinstance(data, dict):
+        raise InvalidMetadata(f"Metadata must be an object, got {type(data).__name__}")
+
+    title = str(data.get("title") or "").strip()
+    description = str(data.get("description") or data.get("pin_description") or "").strip()
+    if not title:
+        raise InvalidMetadata("Metadata has no title")
+    if not description:
+        raise InvalidMetadata("Metadata has no description")
+
+    meta = {
+        "title": title[:TITLE_MAX],
+        "description": description[:DESCRIPTION_MAX],
+        "hashtags": _clean_hashtags(data.get("hashtags")),
+        "alt": str(data.get("alt") or title).strip(),
+    }
+    if data.get("link"):
+        meta["link"] = data["link"]
+    return meta
+
+
+def fallback_metadata(board_name: str, description: str = "") -> dict:
+    """
+    Локальные метаданные, когда модель не вернула пригодный JSON:
+    готовая картинка не выбрасывается из-за текста
+    """
+    first_sentence = re.split(r"(?<=[.!?])\s", description.strip(), maxsplit=1)[0] if description else ""
+    return normalize_metadata(
+        {
+            "title": board_name,
+            "description": first_sentence or board_name,
+            "hashtags": [board_name],
+            "alt": first_sentence or board_name,
+        }
+    )
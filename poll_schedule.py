@@ -0,0 +1,105 @@
+import json
+import os
+import random
+import threading
+
+import checkpoint
+import settings
+
+# ================== CONFIG ==================
+
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "freepik_durations.json")
+HISTORY_SIZE = 50
+MIN_SAMPLES = 5
+
+# Базовая схема, с которой сравнивается экономия вызовов
+FIXED_INTERVAL_SEC = 5
+
+# Пока истории нет: первая проверка через 30 с, дальше как раньше
+DEFAULT_FIRST_POLL_SEC = 30
+DENSE_INTERVAL_SEC = 3
+MAX_INTERVAL_SEC = 30
+JITTER = 0.2
+
+_LOCK = threading.Lock()
+
+
+def _key(model: str, duration: str) -> str:
+    return f"{model}:{duration}"
+
+
+# ================== HISTORY ==================
+
+def _load() -> dict:
+    if not os.path.isfile(HISTORY_PATH):
+        return {}
+    try:
+        with open(HISTORY_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record(model: str, duration: str, seconds: float) -> None:
+    with _LOCK:
+        history = _load()
+        samples = history.setdefault(_key(model, duration), [])
+        samples.append(round(seconds, 1))
+        del samples[:-HISTORY_SIZE]
+        checkpoint.atomic_write_json(HISTORY_PATH, history)
+
+
+def _percentile(samples: list[float], pct: float) -> float:
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+# ================== SCHEDULE ==================
+
+class PollSchedule:
+    """
+    Когда проверять статус задачи: до вероятного окна завершения
+    (p10..p90 прошлых задач той же модели и длительности) не спрашиваем,
+    в окне — часто, после окна — с растущим интервалом и jitter
+    """
+
+    def __init__(self, model: str, duration: str):
+        self.model = model
+        self.duration = str(duration)
+        self.calls = 0
+        samples = _load().get(_key(model, self.duration), [])
+        low = float(settings.get_setting("freepik_poll_window_low_pct", default=10))
+        high = float(settings.get_setting("freepik_poll_window_high_pct", default=90))
+        if len(samples) >= MIN_SAMPLES:
+            self.window = (_percentile(samples, low), _percentile(samples, high))
+        else:
+            self.window = None
+
+    def polled(self) -> None:
+        self.calls += 1
+
+    def next_delay(self, elapsed: float) -> float:
+        if self.window is None:
+            if elapsed < DEFAULT_FIRST_POLL_SEC:
+                return DEFAULT_FIRST_POLL_SEC - elapsed
+            return FIXED_INTERVAL_SEC
+
+        start, end = self.window
+        if elapsed < start:
+            return start - elapsed
+        if elapsed < end:
+            return DENSE_INTERVAL_SEC
+        # После окна: 2x, 4x ... от плотного интервала, с jitter
+        overdue = int((elapsed - end) // MAX_INTERVAL_SEC) + 1
+        delay = DENSE_INTERVAL_SEC * 2 ** overdue * random.uniform(1 - JITTER, 1 + JITTER)
+        return min(MAX_INTERVAL_SEC, delay)
+
+    def finish(self, task_id: str, elapsed: float, completed: bool) -> None:
+        if completed:
+            record(self.model, self.duration, elapsed)
+        fixed = int(elapsed // FIXED_INTERVAL_SEC) + 1
+        print(
+            f"📉 {task_id}: {self.calls} status calls за {elapsed:.0f} с "
+            f"(фикс. {FIXED_INTERVAL_SEC} с: {fixed}, сэкономлено {max(0, fixed - self.calls)})"
+        )
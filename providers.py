@@ -0,0 +1,350 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import accounts
+import checkpoint
+import main
+import main1
+import main3
+import settings
+
+# ================== CONFIG ==================
+
+DEFAULT_PROVIDER_LIMITS = {
+    "gemini": 16,
+    "openai": 8,
+    "freepik": 4,
+    # Скачивание и постобработка готовых видео
+    "video": 3,
+}
+
+# Потоки ожидания задач Freepik почти всё время спят (webhook / расписание);
+# отдельный пул, чтобы они не занимали потоки провайдеров
+VIDEO_WAIT_THREADS = 64
+
+_EXECUTOR: ThreadPoolExecutor | None = None
+_WAIT_EXECUTOR: ThreadPoolExecutor | None = None
+_SEMAPHORES: dict[tuple[int, str], asyncio.Semaphore] = {}
+
+
+def provider_limits() -> dict:
+    limits = dict(DEFAULT_PROVIDER_LIMITS)
+    limits.update(settings.get_setting("provider_concurrency", default={}) or {})
+    return {k: max(1, int(v)) for k, v in limits.items()}
+
+
+def _executor() -> ThreadPoolExecutor:
+    """
+    Общий пул потоков: блокирующие HTTP-вызовы провайдеров выполняются здесь,
+    размер = сумма лимитов, чтобы семафоры, а не пул, ограничивали параллелизм
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        workers = sum(provider_limits().values())
+        _EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="provider")
+    return _EXECUTOR
+
+
+def _wait_executor() -> ThreadPoolExecutor:
+    global _WAIT_EXECUTOR
+    if _WAIT_EXECUTOR is None:
+        _WAIT_EXECUTOR = ThreadPoolExecutor(max_workers=VIDEO_WAIT_THREADS, thread_name_prefix="freepik-wait")
+    return _WAIT_EXECUTOR
+
+
+def _semaphore(provider: str) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    key = (id(loop), provider)
+    sem = _SEMAPHORES.get(key)
+    if sem is None:
+        limit = provider_limits().get(provider, 1)
+        sem = asyncio.Semaphore(limit)
+        _SEMAPHORES[key] = sem
+    return sem
+
+
+async def run_limited(provider: str, fn, *args, **kwargs):
+    """
+    Выполняет блокирующий вызов fn в пуле, не более N одновременно на провайдера
+    """
+    loop = asyncio.get_running_loop()
+    async with _semaphore(provider):
+        return await loop.run_in_executor(_executor(), functools.partial(fn, *args, **kwargs))
+
+
+# ================== GEMINI ==================
+
+async def gemini_describe_image(image_path: str) -> str:
+    return await run_limited("gemini", main1.gemini_describe_image, image_path)
+
+
+async def gemini_generate_similar_image(style_description: str) -> bytes:
+    return await run_limited("gemini", main1.gemini_generate_similar_image, style_description)
+
+
+async def gemini_generate_promo_image(style_description: str) -> bytes:
+    return await run_limited("gemini", main1.gemini_generate_promo_image, style_description)
+
+
+async def gemini_generate_metadata(board_name: str, style_description: str) -> dict:
+    return await run_limited("gemini", main1.gemini_generate_metadata, board_name, style_description)
+
+
+# ================== OPENAI ==================
+
+async def describe_image(image_path: str) -> str:
+    return await run_limited("openai", main.describe_image, image_path)
+
+
+async def generate_image_from_description(description: str) -> bytes:
+    return await run_limited("openai", main.generate_image_from_description, description)
+
+
+async def generate_seo_metadata(board_name: str, description: str) -> dict:
+    return await run_limited("openai", main.generate_seo_metadata, board_name, description)
+
+
+# ================== FREEPIK ==================
+
+async def create_video_task(image_path_or_url: str, prompt: str, **kwargs) -> dict:
+    return await run_limited("freepik", main3.create_video_task, image_path_or_url, prompt, **kwargs)
+
+
+async def get_task_status(task_id: str) -> dict:
+    return await run_limited("freepik", main3.get_task_status, task_id)
+
+
+async def wait_for_completion(task_id: str, timeout_sec: int = 900, duration: str = "5") -> dict:
+    """
+    main3.wait_for_completion (webhook + расписание опроса) в отдельном пуле
+    ожидания; каждый запрос статуса идёт через цикл событий и занимает
+    слот freepik только на время самого запроса
+    """
+    loop = asyncio.get_running_loop()
+
+    def _status(tid: str) -> dict:
+        return asyncio.run_coroutine_threadsafe(get_task_status(tid), loop).result()
+
+    return await loop.run_in_executor(
+        _wait_executor(),
+        functools.partial(main3.wait_for_completion, task_id, timeout_sec, duration, status_fn=_status),
+    )
+
+
+async def animate_pin(
+    image_path_or_url: str,
+    out_mp4: str,
+    prompt: str,
+    negative_prompt: str = "",
+    duration: str = "5",
+    cfg_scale: float = 0.5,
+    webhook_url: str | None = None,
+    overlay: dict | None = None,
+    account_alias: str | None = None,
+):
+    """
+    Слот freepik занят только на создание задачи и запросы статуса;
+    скачивание и кодирование идут под отдельным лимитом video
+    """
+    if main3.video_engine() == "local":
+        await run_limited("video", main3.render_local_video, image_path_or_url, out_mp4, duration, overlay)
+        return
+
+    task_id = await run_limited(
+        "freepik",
+        main3.submit_video_task,
+        image_path_or_url=image_path_or_url,
+        prompt=prompt,
+        negative_prompt=negative_prompt,
+        duration=duration,
+        cfg_scale=cfg_scale,
+        webhook_url=webhook_url,
+        account_alias=account_alias,
+    )
+    result = await wait_for_completion(task_id, duration=duration)
+    await run_limited("video", main3.complete_video_task, result, out_mp4, overlay)
+
+
+# ================== PIPELINES ==================
+
+async def process_board_openai(board: dict, output_dir: str, limit: int = 5, mode: str = "describe"):
+    input_dir = board["input_dir"]
+    if not os.path.isdir(input_dir):
+        raise RuntimeError(f"❌ Папка не найдена: {input_dir}")
+
+    files = main1.list_board_files(input_dir, limit)
+    print(f"\n=== ▶ Генерация по доске: {board['name']} ({board['id']}) ===")
+    if not files:
+        print(f"⚠ Нет референсов для {board['name']} ({board['id']}), пропускаю")
+        return
+
+    manifest = checkpoint.BoardManifest(output_dir)
+    await asyncio.gather(*(
+        run_limited(
+            "openai",
+            main.process_single_image,
+            os.path.join(input_dir, f),
+            output_dir,
+            board["name"],
+            i,
+            mode=mode,
+            manifest=manifest,
+        )
+        for i, f in enumerate(files, start=1)
+    ))
+
+
+async def process_board_gemini(board: dict, output_dir: str, limit: int = 5, mode: str = "describe"):
+    os.makedirs(output_dir, exist_ok=True)
+    files = main1.list_board_files(board["input_dir"], limit)
+
+    print(f"\n=== ▶ {board['name']} ({board['id']}) ({len(files)} files) ===")
+    if not files:
+        print(f"⚠ Нет референсов для {board['name']} ({board['id']}), пропускаю")
+        return
+
+    base_style, pin_metas = await run_limited(
+        "gemini", main1.prepare_board, board["name"], board["input_dir"], files
+    )
+    if base_style is None:
+        return
+
+    regular = files[:4]
+    batch = {}
+    if mode == "describe":
+        batch = await run_limited(
+            "gemini",
+            main1.pregenerate_pin_images,
+            base_style,
+            output_dir,
+            list(range(1, len(regular) + 1)),
+        )
+
+    await asyncio.gather(
+        *(
+            run_limited(
+                "gemini",
+                main1.process_single_image,
+                image_path=os.path.join(board["input_dir"], filename),
+                out_dir=output_dir,
+                board_name=board["name"],
+                index=i,
+                base_style=base_style,
+                metadata=pin_metas[i - 1] if i <= len(pin_metas) else None,
+                mode=mode,
+                image=batch.get(i),
+            )
+            for i, filename in enumerate(regular, start=1)
+        ),
+        run_limited("gemini", main1.process_promo_pin, board["name"], output_dir, base_style),
+    )
+
+
+async def process_board_videos(
+    account_alias: str,
+    board: dict,
+    promo_text: str = "Remote work for women",
+    duration: str = "5",
+    cfg_scale: float = 0.9,
+):
+    ref_files = main3.list_reference_files(board["dir"])
+    if not ref_files:
+        print(f"⚠ Нет референсов для {board['name']} ({board['id']}), пропускаю")
+        return
+
+    out_dir = os.path.join("generated_videos", account_alias, board["id"])
+    os.makedirs(out_dir, exist_ok=True)
+
+    base_style = await run_limited("gemini", main3.load_board_style, account_alias, board["id"], ref_files)
+
+    async def _video_pin(idx: int, filename: str):
+        out_mp4 = os.path.join(out_dir, f"{idx}.mp4")
+        if not os.path.exists(out_mp4):
+            await animate_pin(
+                os.path.join(board["dir"], filename),
+                out_mp4,
+                main3.VIDEO_PROMPT,
+                negative_prompt=main3.VIDEO_NEGATIVE,
+                duration=duration,
+                cfg_scale=cfg_scale,
+                account_alias=account_alias,
+            )
+        out_json = os.path.join(out_dir, f"{idx}.json")
+        await run_limited("gemini", main3.write_video_metadata, out_json, board["name"], base_style)
+
+    async def _promo():
+        promo_video = os.path.join(out_dir, "5.mp4")
+        if not os.path.exists(promo_video):
+            clean_path = await run_limited(
+                "gemini", main3.prepare_promo_source, account_alias, board["id"], base_style
+            )
+            await animate_pin(
+                clean_path,
+                promo_video,
+                main3.PROMO_PROMPT,
+                negative_prompt=main3.PROMO_NEGATIVE,
+                duration=duration,
+                cfg_scale=cfg_scale,
+                overlay=main3.promo_overlay(promo_text),
+                account_alias=account_alias,
+            )
+        promo_json = os.path.join(out_dir, "5.json")
+        await run_limited("gemini", main3.write_promo_metadata, promo_json, board["name"])
+
+    labels = [f"{board['id']}/{idx}" for idx in range(1, len(ref_files[:4]) + 1)] + [f"{board['id']}/promo"]
+    results = await asyncio.gather(
+        *(_video_pin(idx, filename) for idx, filename in enumerate(ref_files[:4], start=1)),
+        _promo(),
+        return_exceptions=True,
+    )
+    for label, result in zip(labels, results):
+        if isinstance(result, Exception):
+            print(f"❌ Видео {label}: {type(result).__name__}: {result}")
+
+
+async def _guarded(coro, label: str):
+    try:
+        await coro
+    except Exception as e:
+        print(f"❌ Ошибка обработки доски {label}: {type(e).__name__}: {e}")
+
+
+async def process_account(account, model: str = "gemini", limit: int = 5):
+    """
+    Асинхронный аналог process_account для всех бэкендов:
+    все доски и пины аккаунта обрабатываются одновременно в пределах
+    лимитов provider_concurrency
+    """
+    alias = account["alias"]
+    mode = accounts.get_generation_mode(account)
+
+    if model == "video":
+        boards = main3.list_account_boards(alias)
+        coros = [(process_board_videos(alias, b), b["id"]) for b in boards]
+    elif model == "openai":
+        boards = main.list_account_boards(account)
+        coros = [
+            (process_board_openai(b, os.path.join("generated", alias, b["id"]), limit, mode), b["id"])
+            for b in boards
+        ]
+    else:
+        boards = main1.list_account_boards(account)
+        coros = [
+            (process_board_gemini(b, os.path.join("generated_gemini", alias, b["id"]), limit, mode), b["id"])
+            for b in boards
+        ]
+
+    if not boards:
+        print("❌ Boards not found for account:", alias)
+        return
+
+    await asyncio.gather(*(_guarded(c, label) for c, label in coros))
+
+
+# ================== RUN ==================
+
+if __name__ == "__main__":
+    account = accounts.get_account_from_env()
+    asyncio.run(process_account(account, model=os.getenv("MODEL", "gemini")))
@@ -1,7 +1,15 @@
 import os
 import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import requests
 import accounts
+import retry
+import settings
+import video_cover
 
 os.environ["NO_PROXY"] = "*"
 os.environ["no_proxy"] = "*"
@@ -12,13 +20,15 @@ session = requests.Session()
 session.trust_env = False
 
 def get_pinterest_account_id(account):
-    r = session.get(
-        f"{account['late_base_url']}/accounts",
-        headers={"Authorization": f"Bearer {account['late_api_key']}"},
-    )
-    r.raise_for_status()
+    def _do():
+        r = session.get(
+            f"{account['late_base_url']}/accounts",
+            headers={"Authorization": f"Bearer {account['late_api_key']}"},
+        )
+        r.raise_for_status()
+        return r.json()
 
-    for acc in r.json().get("accounts", []):
+    for acc in retry.call(_do, provider="late").get("accounts", []):
         if acc.get("platform") == "pinterest":
             return acc["_id"]
 
@@ -27,13 +37,15 @@ def get_pinterest_account_id(account):
 
 
 def get_pinterest_boards(account, account_id):
-    r = session.get(
-        f"{account['late_base_url']}/accounts/{account_id}/pinterest-boards",
-        headers={"Authorization": f"Bearer {account['late_api_key']}"},
-    )
-    r.raise_for_status()
+    def _do():
+        r = session.get(
+            f"{account['late_base_url']}/accounts/{account_id}/pinterest-boards",
+            headers={"Authorization": f"Bearer {account['late_api_key']}"},
+        )
+        r.raise_for_status()
+        return r.json()
 
-    boards = r.json().get("boards", [])
+    boards = retry.call(_do, provider="late").get("boards", [])
     print("\n🧩 Доски:")
     for b in boards:
         print(f" • {b['name']} ({b['id']})")
@@ -62,18 +74,21 @@ def late_upload_media(account, media_path: str) -> str:
         "Authorization": f"Bearer {account['late_api_key']}"
     }
 
-    with open(media_path, "rb") as f:
-        files = {
-            "files": (os.path.basename(media_path), f, _guess_mime(media_path))
-        }
+    def _do():
+        with open(media_path, "rb") as f:
+            files = {
+                "files": (os.path.basename(media_path), f, _guess_mime(media_path))
+            }
 
-        r = session.post(url, headers=headers, files=files, timeout=60)
+            _late_rate_limit()
+            r = session.post(url, headers=headers, files=files, timeout=60)
 
-    print("RAW:", r.text)
+        print("RAW:", r.text)
 
-    r.raise_for_status()
+        r.raise_for_status()
+        return r.json()
 
-    data = r.json()
+    data = retry.call(_do, provider="late", model="media")
 
 
     return data["files"][0]["url"]
@@ -88,6 +103,7 @@ def late_publish_pin(
     media_url: str,
     link: str = None,
     media_type: str | None = "image",
+    cover_url: str | None = None,
 ):
     url = f"{account['late_base_url']}/posts"
     headers = {
@@ -119,29 +135,46 @@ def late_publish_pin(
     if link:
         payload["platforms"][0]["platformSpecificData"]["link"] = link
 
+    # Обложка видео-пина; без неё Pinterest берёт первый кадр
+    if cover_url:
+        payload["platforms"][0]["platformSpecificData"]["coverImageUrl"] = cover_url
+
     print("📤 PUBLISHING:", json.dumps(payload, indent=2, ensure_ascii=False))
 
-    r = session.post(url, headers=headers, json=payload, timeout=60)
-    if r.status_code != 200:
-        print("❌ ERROR:", r.text)
-        r.raise_for_status()
-    return r.json()
+    def _do():
+        _late_rate_limit()
+        r = session.post(url, headers=headers, json=payload, timeout=60)
+        if r.status_code != 200:
+            print("❌ ERROR:", r.text)
+            r.raise_for_status()
+        return r.json()
+
+    # POST /posts не идемпотентен: повторяем только явный отказ по лимиту
+    return retry.call(_do, provider="late", model="posts", retry_statuses={429}, idempotent=False)
+
+
+def _find_media(json_path: str, exts: tuple) -> str:
+    base = json_path[: -len(".json")]
+    for ext in exts:
+        if os.path.isfile(base + ext):
+            return base + ext
+    return base + exts[0]
 
 
 def build_pin_records_from_generated(account, board_id: str, limit=5, media_kind: str = "image"):
     if media_kind == "video":
         folder = os.path.join("generated_videos", account["alias"], board_id)
-        media_ext = ".mp4"
+        media_ext = (".mp4",)
     else:
         folder = os.path.join("generated_gemini", account["alias"], board_id)
-        media_ext = ".jpg"
+        media_ext = (".jpg", ".webp")
     records = []
 
     files = sorted([f for f in os.listdir(folder) if f.endswith(".json")])[:limit]
 
     for f in files:
         json_path = os.path.join(folder, f)
-        media_path = json_path.replace(".json", media_ext)
+        media_path = _find_media(json_path, media_ext)
 
         with open(json_path, "r") as jf:
             data = json.load(jf)
@@ -150,6 +183,7 @@ def build_pin_records_from_generated(account, board_id: str, limit=5, media_kind
         record = {
             "media_path": media_path,
             "json_path": json_path,
+            "cover_path": None,
             "title": meta.get("title"),
             "description": meta.get("description"),
             "alt_text": meta.get("alt"),
@@ -157,6 +191,13 @@ def build_pin_records_from_generated(account, board_id: str, limit=5, media_kind
             "link": meta.get("link"),
         }
 
+        if media_kind == "video":
+            cover_path = video_cover.path(media_path)
+            if os.path.isfile(cover_path):
+                record["cover_path"] = cover_path
+            # превью только для оператора: в Late не загружается, удаляется вместе с пином
+            record["thumb_path"] = video_cover.preview_path(media_path)
+
         records.append(record)
 
     return records
@@ -199,66 +240,129 @@ def _remove_images_in_dir(dir_path: str) -> int:
     return removed
 
 
-def publish_generated_board(account, board_id: str, media_kind: str = "image"):
-    meta = load_board_meta(account, board_id)
-    print("\n=== ▶ Публикация доски:", meta.get("name"), f"({board_id}) ===")
+class RateLimiter:
+    """
+    Не больше per_minute запросов за любые 60 с на все потоки;
+    в пределах лимита запросы идут без задержки
+    """
+
+    def __init__(self, per_minute: int):
+        self.per_minute = max(1, per_minute)
+        self._sent: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._sent and now - self._sent[0] >= 60:
+                    self._sent.popleft()
+                if len(self._sent) < self.per_minute:
+                    self._sent.append(now)
+                    return
+                wait = 60 - (now - self._sent[0])
+            time.sleep(wait)
+
+
+_late_limiter: RateLimiter | None = None
+_late_limiter_lock = threading.Lock()
+
+
+def _late_rate_limit() -> None:
+    global _late_limiter
+    with _late_limiter_lock:
+        if _late_limiter is None:
+            _late_limiter = RateLimiter(int(settings.get_setting("late_rate_limit_per_min", default=60)))
+    _late_limiter.acquire()
+
+
+def _cleanup_board_images(account, board_id: str) -> None:
+    refs_dir = os.path.join("boards", account["alias"], board_id)
+    removed_refs = _remove_images_in_dir(refs_dir)
+    gen_gemini_dir = os.path.join("generated_gemini", account["alias"], board_id)
+    removed_gen_gemini = _remove_images_in_dir(gen_gemini_dir)
+    gen_openai_dir = os.path.join("generated", account["alias"], board_id)
+    removed_gen_openai = _remove_images_in_dir(gen_openai_dir)
+    if removed_refs or removed_gen_gemini or removed_gen_openai:
+        print(
+            "🧹 Удалены изображения после публикации: "
+            f"refs={removed_refs}, gemini={removed_gen_gemini}, openai={removed_gen_openai}"
+        )
+
+
+def _publish_pin(account, profile_id: str, board_id: str, pin: dict, media_kind: str) -> dict:
+    media_url = late_upload_media(account, pin["media_path"])
+    cover_url = late_upload_media(account, pin["cover_path"]) if pin.get("cover_path") else None
+
+    media_type = "video" if media_kind == "video" else "image"
+    post = late_publish_pin(
+        account=account,
+        pinterest_account_id=profile_id,
+        board_id=board_id,
+        title=pin.get("title") or "",
+        description=(pin.get("description") or "") + "\n\n" + " ".join(pin.get("hashtags") or []),
+        media_url=media_url,
+        link=pin.get("link"),  # ← None или строка
+        media_type=media_type,
+        cover_url=cover_url,
+    )
+
+    pin["published"] = post
+    pin["media_url"] = media_url
+
+    print("✔ Успешно опубликовано:", pin["title"])
+    for path in (pin.get("media_path"), pin.get("json_path"), pin.get("cover_path"), pin.get("thumb_path")):
+        if path and os.path.isfile(path):
+            os.remove(path)
+    print("🧹 Удалены файлы пина после публикации")
+    return pin
+
+
+def publish_generated_boards(account, board_ids: list[str], media_kind: str = "image") -> dict[str, list]:
+    """
+    Публикация всех досок аккаунта: загрузка медиа и создание поста
+    по каждому пину идут параллельно (не больше late_publish_concurrency),
+    запросы к Late — в пределах late_rate_limit_per_min.
+    Файлы пина удаляются сразу после его публикации, картинки доски —
+    только если все её пины опубликованы. Возвращает {board_id: [pins]}.
+    """
     profile_id = get_pinterest_account_id(account)
 
-    # 2) собираем записи из папки generated/
-    pins = build_pin_records_from_generated(account, board_id, media_kind=media_kind)
-
-    print(f"Найдено {len(pins)} записей для публикации")
-
-    published = []
-
-    failed = 0
-    # 3) публикация
-    for pin in pins:
-        try:
-            media_url = late_upload_media(account, pin["media_path"])
-
-            media_type = "video" if media_kind == "video" else "image"
-            post = late_publish_pin(
-                account=account,
-                pinterest_account_id=profile_id,
-                board_id=board_id,
-                title=pin.get("title") or "",
-                description=(pin.get("description") or "") + "\n\n" + " ".join(pin.get("hashtags") or []),
-                media_url=media_url,
-                link=pin.get("link"),  # ← None или строка
-                media_type=media_type,
-            )
-
-            pin["published"] = post
-            pin["media_url"] = media_url
-            published.append(pin)
-
-            print("✔ Успешно опубликовано:", pin["title"])
-            for path in (pin.get("media_path"), pin.get("json_path")):
-                if path and os.path.isfile(path):
-                    os.remove(path)
-            print("🧹 Удалены файлы пина после публикации")
-
-        except Exception as e:
-            print("❌ Ошибка публикации:", e)
-            failed += 1
-
-    if pins and failed == 0:
-        refs_dir = os.path.join("boards", account["alias"], board_id)
-        removed_refs = _remove_images_in_dir(refs_dir)
-        gen_gemini_dir = os.path.join("generated_gemini", account["alias"], board_id)
-        removed_gen_gemini = _remove_images_in_dir(gen_gemini_dir)
-        gen_openai_dir = os.path.join("generated", account["alias"], board_id)
-        removed_gen_openai = _remove_images_in_dir(gen_openai_dir)
-        if removed_refs or removed_gen_gemini or removed_gen_openai:
-            print(
-                "🧹 Удалены изображения после публикации: "
-                f"refs={removed_refs}, gemini={removed_gen_gemini}, openai={removed_gen_openai}"
-            )
+    pins_by_board = {}
+    for board_id in board_ids:
+        meta = load_board_meta(account, board_id)
+        print("\n=== ▶ Публикация доски:", meta.get("name"), f"({board_id}) ===")
+        # собираем записи из папки generated/
+        pins_by_board[board_id] = build_pin_records_from_generated(account, board_id, media_kind=media_kind)
+        print(f"Найдено {len(pins_by_board[board_id])} записей для публикации")
+
+    published = {board_id: [] for board_id in board_ids}
+    failed = {board_id: 0 for board_id in board_ids}
+    workers = max(1, int(settings.get_setting("late_publish_concurrency", default=4)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_publish_pin, account, profile_id, board_id, pin, media_kind): board_id
+            for board_id, pins in pins_by_board.items()
+            for pin in pins
+        }
+        for fut in as_completed(futures):
+            board_id = futures[fut]
+            try:
+                published[board_id].append(fut.result())
+            except Exception as e:
+                print("❌ Ошибка публикации:", e)
+                failed[board_id] += 1
+
+    for board_id, pins in pins_by_board.items():
+        if pins and failed[board_id] == 0:
+            _cleanup_board_images(account, board_id)
 
     return published
 
+
+def publish_generated_board(account, board_id: str, media_kind: str = "image"):
+    return publish_generated_boards(account, [board_id], media_kind=media_kind)[board_id]
+
 if __name__ == "__main__":
     account = accounts.get_account_from_env()
-    for board_id in list_account_board_ids(account):
-        publish_generated_board(account, board_id)
+    publish_generated_boards(account, list_account_board_ids(account))
@@ -0,0 +1,138 @@
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+import settings
+
+# ================== CONFIG ==================
+
+REJECTS_NAME = "_rejected.json"
+
+DEFAULTS = {
+    "ref_min_side": 400,
+    "ref_min_aspect": 0.4,
+    "ref_max_aspect": 1.5,
+    "ref_min_sharpness": 25.0,
+    "ref_max_edge_density": 0.12,
+}
+
+# Анализ на уменьшенной копии: быстро и не зависит от исходного разрешения
+ANALYSIS_SIDE = 512
+EDGE_THRESHOLD = 48
+
+
+def _limit(key: str) -> float:
+    return float(settings.get_setting(key, default=DEFAULTS[key]))
+
+
+# ================== SCORES ==================
+
+def _gray(img: Image.Image) -> np.ndarray:
+    img = img.convert("L")
+    img.thumbnail((ANALYSIS_SIDE, ANALYSIS_SIDE), Image.BILINEAR)
+    return np.asarray(img, dtype=np.float32)
+
+
+def sharpness(gray: np.ndarray) -> float:
+    """
+    Дисперсия лапласиана: мало — размыто
+    """
+    lap = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+        - 4 * gray[1:-1, 1:-1]
+    )
+    return float(lap.var())
+
+
+def edge_density(gray: np.ndarray) -> float:
+    """
+    Доля пикселей с резким перепадом яркости. Скриншоты и картинки
+    с большим количеством текста дают заметно больше мелких краёв, чем фото
+    """
+    gx = np.abs(np.diff(gray, axis=1))[:-1, :]
+    gy = np.abs(np.diff(gray, axis=0))[:, :-1]
+    return float(((gx + gy) > EDGE_THRESHOLD).mean())
+
+
+def score_image(path: str) -> dict:
+    with Image.open(path) as img:
+        width, height = img.size
+        gray = _gray(img)
+    return {
+        "width": width,
+        "height": height,
+        "aspect": round(width / height, 3) if height else 0.0,
+        "sharpness": round(sharpness(gray), 1),
+        "edge_density": round(edge_density(gray), 4),
+    }
+
+
+def check_image(path: str) -> tuple[bool, list[str], dict]:
+    """
+    Локальная проверка референса до платных вызовов:
+    (годится, причины отказа, метрики)
+    """
+    try:
+        scores = score_image(path)
+    except Exception as e:
+        return False, [f"unreadable: {e}"], {}
+
+    reasons = []
+    if min(scores["width"], scores["height"]) < _limit("ref_min_side"):
+        reasons.append("too_small")
+    if not _limit("ref_min_aspect") <= scores["aspect"] <= _limit("ref_max_aspect"):
+        reasons.append("aspect_ratio")
+    if scores["sharpness"] < _limit("ref_min_sharpness"):
+        reasons.append("blurry")
+    if scores["edge_density"] > _limit("ref_max_edge_density"):
+        reasons.append("text_or_screenshot")
+    return not reasons, reasons, scores
+
+
+# ================== REJECTS ==================
+
+def record_rejection(board_dir: str, name: str, reasons: list[str], scores: dict, source: str | None = None) -> None:
+    path = os.path.join(board_dir, REJECTS_NAME)
+    rejects = []
+    if os.path.isfile(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                rejects = json.load(f)
+        except (OSError, ValueError):
+            rejects = []
+
+    rejects = [r for r in rejects if (r.get("file"), r.get("source")) != (name, source)]
+    rejects.append(
+        {
+            "file": name,
+            "source": source,
+            "reasons": reasons,
+            "scores": scores,
+            "at": time.time(),
+        }
+    )
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(rejects, f, indent=2, ensure_ascii=False)
+
+
+def filter_references(board_dir: str, files: list[str]) -> list[str]:
+    """
+    Оставляет только референсы, прошедшие проверку; отказы пишутся
+    в _rejected.json доски
+    """
+    if not settings.get_setting("reference_quality_gate", default=True):
+        return files
+
+    passed = []
+    for name in files:
+        path = os.path.join(board_dir, name)
+        ok, reasons, scores = check_image(path)
+        if ok:
+            passed.append(name)
+            continue
+        print(f"🚫 Референс отклонён: {name} ({', '.join(reasons)})")
+        record_rejection(board_dir, name, reasons, scores)
+    return passed
@@ -0,0 +1,230 @@
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+# ================== CONFIG ==================
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN_SEC = 60.0
+MAX_RETRY_AFTER_SEC = 300.0
+
+# Коды ошибок квоты, которые не лечатся ожиданием
+HARD_QUOTA_CODES = {"insufficient_quota", "billing_hard_limit_reached"}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# ================== CLASSIFICATION ==================
+
+def _error_body(resp) -> dict:
+    try:
+        data = resp.json()
+    except ValueError:
+        return {}
+    err = data.get("error") if isinstance(data, dict) else None
+    return err if isinstance(err, dict) else {}
+
+
+def _parse_duration(value: str) -> float | None:
+    value = str(value).strip()
+    if value.endswith("s"):
+        value = value[:-1]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def retry_after_seconds(resp) -> float | None:
+    """
+    Сколько ждать по ответу сервера: заголовок Retry-After (секунды или
+    HTTP-дата) либо RetryInfo.retryDelay из ошибки квоты Gemini
+    """
+    header = resp.headers.get("Retry-After") if resp is not None else None
+    if header:
+        seconds = _parse_duration(header)
+        if seconds is not None:
+            return max(0.0, seconds)
+        try:
+            dt = email.utils.parsedate_to_datetime(header)
+            return max(0.0, dt.timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+
+    if resp is None:
+        return None
+    for detail in _error_body(resp).get("details") or []:
+        if isinstance(detail, dict) and "retryDelay" in detail:
+            return _parse_duration(detail["retryDelay"])
+    return None
+
+
+def is_retryable(exc: Exception, retry_statuses=RETRYABLE_STATUS, idempotent: bool = True) -> bool:
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        # запрос мог дойти до сервера — повторять можно только идемпотентные
+        return idempotent
+    if isinstance(exc, requests.exceptions.HTTPError):
+        resp = exc.response
+        if resp is None:
+            return True
+        if resp.status_code == 429 and _error_body(resp).get("code") in HARD_QUOTA_CODES:
+            return False
+        return resp.status_code in retry_statuses
+    return False
+
+
+# ================== CIRCUIT BREAKER ==================
+
+class CircuitBreaker:
+    """
+    Размыкается после N подряд неудачных вызовов (каждый — со всеми своими
+    повторами); пока разомкнут, вызовы падают сразу. После cooldown
+    пропускает один пробный вызов
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, cooldown: float = CIRCUIT_COOLDOWN_SEC):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self, name: str) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_in_flight:
+                raise CircuitOpenError(f"Circuit open for {name}")
+            self._trial_in_flight = True
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_BREAKERS: dict[tuple[str, str], CircuitBreaker] = {}
+_STATS: dict[tuple[str, str], dict] = {}
+_LOCK = threading.Lock()
+
+
+def breaker(provider: str, model: str = "") -> CircuitBreaker:
+    with _LOCK:
+        return _BREAKERS.setdefault((provider, model), CircuitBreaker())
+
+
+def _stat(provider: str, model: str, **delta) -> None:
+    with _LOCK:
+        st = _STATS.setdefault(
+            (provider, model),
+            {"calls": 0, "retries": 0, "wait_sec": 0.0, "failures": 0, "short_circuited": 0},
+        )
+        for k, v in delta.items():
+            st[k] += v
+
+
+def reset_stats() -> None:
+    with _LOCK:
+        _STATS.clear()
+
+
+def retry_stats() -> dict:
+    with _LOCK:
+        return {f"{p}/{m}" if m else p: dict(st) for (p, m), st in _STATS.items()}
+
+
+def format_stats() -> str:
+    lines = []
+    for name, st in sorted(retry_stats().items()):
+        lines.append(
+            f"{name}: calls={st['calls']} retries={st['retries']} "
+            f"wait={st['wait_sec']:.1f}s failures={st['failures']} "
+            f"short_circuited={st['short_circuited']}"
+        )
+    return "\n".join(lines)
+
+
+# ================== RETRY ==================
+
+def call(
+    fn,
+    provider: str,
+    model: str = "",
+    max_retries: int = 4,
+    base_delay: float = 2,
+    max_delay: float = 30,
+    retry_statuses=RETRYABLE_STATUS,
+    retry_on: tuple = (),
+    idempotent: bool = True,
+):
+    """
+    Вызывает fn с повторами только для временных ошибок, учитывая
+    Retry-After и общий для provider/model circuit breaker.
+    Breaker проверяется один раз на вызов и получает одну неудачу,
+    только когда повторы исчерпаны
+    """
+    name = f"{provider}/{model}" if model else provider
+    cb = breaker(provider, model)
+    _stat(provider, model, calls=1)
+
+    try:
+        cb.before_call(name)
+    except CircuitOpenError:
+        _stat(provider, model, short_circuited=1)
+        raise
+
+    for attempt in range(1, max_retries + 1):
+        try:
+            result = fn()
+        except Exception as e:
+            transient = isinstance(e, retry_on) or is_retryable(e, retry_statuses, idempotent)
+            if not transient:
+                # провайдер ответил — ошибка в самом запросе, сам провайдер доступен
+                cb.on_success()
+                _stat(provider, model, failures=1)
+                raise
+
+            if attempt == max_retries:
+                print(f"❌ Retries exhausted ({name})")
+                cb.on_failure()
+                _stat(provider, model, failures=1)
+                raise
+
+            delay = min(base_delay * (2 ** (attempt - 1)), max_delay) + random.uniform(0, 1)
+            resp = getattr(e, "response", None)
+            server_delay = retry_after_seconds(resp) if resp is not None else None
+            if server_delay is not None:
+                if server_delay > MAX_RETRY_AFTER_SEC:
+                    cb.on_failure()
+                    _stat(provider, model, failures=1)
+                    raise
+                delay = max(delay, server_delay)
+
+            print(
+                f"⏳ {name} unstable ({type(e).__name__}), "
+                f"retry {attempt}/{max_retries} in {delay:.1f}s"
+            )
+            _stat(provider, model, retries=1, wait_sec=delay)
+            time.sleep(delay)
+            continue
+
+        cb.on_success()
+        return result
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import main
+import main1
+import settings
+
+# ================== CONFIG ==================
+
+PRIMARY = "gemini"
+FALLBACK = "openai"
+
+HISTOGRAM_WINDOW = 200
+DEFAULT_PERCENTILE = 90
+DEFAULT_MIN_SAMPLES = 10
+DEFAULT_HEDGE_DELAY_SEC = 60.0
+DEFAULT_FAILURE_THRESHOLD = 3
+
+# Размеры пулов по умолчанию совпадают с providers.DEFAULT_PROVIDER_LIMITS
+DEFAULT_POOL_SIZES = {PRIMARY: 16, FALLBACK: 8}
+
+# Отдельные пулы: хедж не должен стоять в очереди за зависшими
+# основными запросами, с которыми он соревнуется
+_EXECUTORS: dict[str, ThreadPoolExecutor] = {}
+_EXECUTORS_LOCK = threading.Lock()
+
+
+def _executor(provider: str) -> ThreadPoolExecutor:
+    with _EXECUTORS_LOCK:
+        if provider not in _EXECUTORS:
+            limits = settings.get_setting("provider_concurrency", default={}) or {}
+            size = max(1, int(limits.get(provider, DEFAULT_POOL_SIZES[provider])))
+            _EXECUTORS[provider] = ThreadPoolExecutor(max_workers=size, thread_name_prefix=f"hedge-{provider}")
+        return _EXECUTORS[provider]
+
+
+# ================== LATENCY ==================
+
+class LatencyHistogram:
+    """
+    Скользящее окно последних длительностей успешных вызовов провайдера
+    """
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.consecutive_failures = 0
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            if ok:
+                self._samples.append(seconds)
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p: float) -> float | None:
+        with self._lock:
+            if not self._samples:
+                return None
+            data = sorted(self._samples)
+        k = min(len(data) - 1, max(0, int(round(p / 100 * (len(data) - 1)))))
+        return data[k]
+
+
+# Отдельное окно на каждый размер пачки: вызов на 4 картинки нельзя
+# сравнивать с перцентилем одиночных
+_HISTOGRAMS: dict[tuple[str, int], LatencyHistogram] = {}
+_HISTOGRAMS_LOCK = threading.Lock()
+
+
+def histogram(provider: str, n: int = 1) -> LatencyHistogram:
+    with _HISTOGRAMS_LOCK:
+        return _HISTOGRAMS.setdefault((provider, n), LatencyHistogram())
+
+
+def _timed(provider: str, n: int, fn, *args):
+    started = time.monotonic()
+    try:
+        result = fn(*args)
+    except Exception:
+        histogram(provider, n).record(time.monotonic() - started, ok=False)
+        raise
+    histogram(provider, n).record(time.monotonic() - started)
+    return result
+
+
+def hedge_delay(provider: str = PRIMARY, n: int = 1) -> float:
+    """
+    Через сколько секунд ожидания основного провайдера отправлять хедж-запрос
+    для вызова на n картинок
+    """
+    percentile = float(settings.get_setting("hedge_percentile", default=DEFAULT_PERCENTILE))
+    min_samples = int(settings.get_setting("hedge_min_samples", default=DEFAULT_MIN_SAMPLES))
+    default = float(settings.get_setting("hedge_default_delay_sec", default=DEFAULT_HEDGE_DELAY_SEC))
+
+    h = histogram(provider, n)
+    if h.count() < min_samples:
+        return default
+    return h.percentile(percentile) or default
+
+
+# ================== ROUTER ==================
+
+def _hedged(n: int, primary_fn, fallback_fn, *args):
+    """
+    Запускает primary_fn у основного провайдера; если вызов дольше порога по
+    гистограмме вызовов на n картинок или падает, параллельно запускает fallback_fn и берёт первый успех
+    """
+    failure_threshold = int(
+        settings.get_setting("hedge_failure_threshold", default=DEFAULT_FAILURE_THRESHOLD)
+    )
+
+    primary = _executor(PRIMARY).submit(_timed, PRIMARY, n, primary_fn, *args)
+    pending = {primary}
+
+    if histogram(PRIMARY, n).consecutive_failures >= failure_threshold:
+        print(f"⚡ {PRIMARY} failing repeatedly, hedging immediately")
+        delay = 0.0
+    else:
+        delay = hedge_delay(PRIMARY, n)
+
+    done, _ = wait(pending, timeout=delay)
+    if primary in done and primary.exception() is None:
+        return primary.result()
+
+    reason = "failed" if primary in done else f"slower than {delay:.1f}s"
+    print(f"⚡ {PRIMARY} {reason}, sending hedged request to {FALLBACK}")
+    pending.add(_executor(FALLBACK).submit(_timed, FALLBACK, n, fallback_fn, *args))
+    pending -= done
+
+    last_error = primary.exception() if primary in done else None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            if fut.exception() is None:
+                provider = PRIMARY if fut is primary else FALLBACK
+                print(f"✔ Hedged image served by {provider}")
+                return fut.result()
+            last_error = fut.exception()
+
+    raise last_error
+
+
+def generate_image_hedged(style_description: str) -> bytes:
+    """
+    Одна картинка: Gemini, с хеджем в OpenAI
+    """
+    return _hedged(1, main1.gemini_generate_similar_image, main.generate_image_from_description, style_description)
+
+
+def generate_images_hedged(style_description: str, n: int) -> list[bytes]:
+    """
+    n картинок одного стиля пачкой (candidateCount у Gemini, n у OpenAI),
+    с тем же хеджем
+    """
+    return _hedged(
+        n, main1.gemini_generate_similar_images, main.generate_images_from_description, style_description, n
+    )
@@ -0,0 +1,74 @@
+import os
+import json
+import threading
+import time
+
+import checkpoint
+
+STYLE_NAME = "_style.json"
+
+_LOCKS: dict[str, threading.Lock] = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+def _lock(board_dir: str) -> threading.Lock:
+    with _LOCKS_GUARD:
+        return _LOCKS.setdefault(os.path.abspath(board_dir), threading.Lock())
+
+
+def source_file(files: list[str]) -> str:
+    """
+    Референс, по которому описывается стиль доски: всегда первый
+    по имени, чтобы все бэкенды выбирали один и тот же
+    """
+    if not files:
+        raise RuntimeError("No reference images to describe")
+    return sorted(files)[0]
+
+
+def load(board_dir: str, files: list[str]) -> dict | None:
+    """
+    Запись стиля доски, если она описывает текущий набор референсов
+    """
+    path = os.path.join(board_dir, STYLE_NAME)
+    if not os.path.isfile(path) or not files:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    source = source_file(files)
+    if record.get("source_file") != source:
+        return None
+    if record.get("source_hash") != checkpoint.file_hash(os.path.join(board_dir, source)):
+        return None
+    return record
+
+
+def get_or_create(board_dir: str, files: list[str], describe, model: str) -> tuple[dict, object]:
+    """
+    Стиль доски из общего хранилища (_style.json рядом с референсами)
+    или один вызов describe(source_path) -> (style, extra) и запись результата.
+    Возвращает (record, extra); extra = None, если стиль взят из хранилища.
+    """
+    with _lock(board_dir):
+        record = load(board_dir, files)
+        if record:
+            print(f"⏭ board style loaded from store ({record['source_file']})")
+            return record, None
+
+        source = source_file(files)
+        source_path = os.path.join(board_dir, source)
+        style, extra = describe(source_path)
+        record = {
+            "style": style,
+            "source_file": source,
+            "source_hash": checkpoint.file_hash(source_path),
+            "model": model,
+            "created_at": time.time(),
+        }
+        checkpoint.atomic_write_json(os.path.join(board_dir, STYLE_NAME), record)
+        print(f"✔ board style stored ({source}, {model})")
+        return record, extra
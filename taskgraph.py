@@ -0,0 +1,50 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def run_graph(tasks: dict, executor: ThreadPoolExecutor) -> tuple[dict, dict]:
+    """
+    Выполняет граф задач {name: (fn, [deps])} в пуле потоков.
+    fn вызывается с результатами зависимостей в порядке deps; задача
+    стартует, как только готовы все её зависимости. Если задача упала,
+    зависимые от неё не запускаются.
+    Возвращает (results, errors).
+    """
+    for name, (_, deps) in tasks.items():
+        for dep in deps:
+            if dep not in tasks:
+                raise ValueError(f"Unknown dependency {dep!r} for task {name!r}")
+
+    results: dict = {}
+    errors: dict = {}
+    running: dict = {}
+    waiting = dict(tasks)
+
+    while waiting or running:
+        changed = True
+        while changed:
+            changed = False
+            for name, (fn, deps) in list(waiting.items()):
+                if any(d in errors for d in deps):
+                    errors[name] = RuntimeError(f"skipped: dependency failed ({name})")
+                elif all(d in results for d in deps):
+                    running[executor.submit(fn, *(results[d] for d in deps))] = name
+                else:
+                    continue
+                del waiting[name]
+                changed = True
+
+        if not running:
+            if waiting:
+                raise ValueError(f"Dependency cycle in tasks: {sorted(waiting)}")
+            break
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = running.pop(fut)
+            exc = fut.exception()
+            if exc is None:
+                results[name] = fut.result()
+            else:
+                errors[name] = exc
+
+    return results, errors
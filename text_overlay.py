@@ -1,4 +1,18 @@
-from PIL import Image
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+import transcode
+
+_LOCK = threading.Lock()
+
+DEFAULT_FONT = "DejaVuSans.ttf"
+LAYERS_DIR = "text_layers"
+
 
 def crop_to_content(input_path: str, output_path: str, padding: int = 10):
     img = Image.open(input_path).convert("RGBA")
@@ -22,6 +36,206 @@ def crop_to_content(input_path: str, output_path: str, padding: int = 10):
     print(f"✔ Cropped text layer saved to {output_path}")
 
 
+
+# ================== OVERLAY ==================
+
+@lru_cache(maxsize=8)
+def _load_layer(path: str, mtime: float) -> Image.Image:
+    with Image.open(path) as img:
+        return img.convert("RGBA")
+
+
+@lru_cache(maxsize=64)
+def _placed_layer(
+    path: str,
+    mtime: float,
+    bg_size: tuple[int, int],
+    scale: float,
+    position: str,
+) -> tuple[Image.Image, tuple[int, int]]:
+    """
+    Текстовый слой, уже отмасштабированный под фон bg_size, и его позиция.
+    Кэшируется: промо-фоны почти всегда одного размера
+    """
+    txt = _load_layer(path, mtime)
+    BW, BH = bg_size
+
+    new_w = int(BW * scale)
+    ratio = new_w / txt.width
+    new_h = int(txt.height * ratio)
+    txt = txt.resize((new_w, new_h), Image.LANCZOS)
+
+    if position == "top":
+        x = (BW - new_w) // 2
+        y = int(BH * 0.001)
+    elif position == "center":
+        x = (BW - new_w) // 2
+        y = (BH - new_h) // 2
+    else:
+        raise ValueError("position must be top or center")
+
+    return txt, (x, y)
+
+
+def placed_layer(path: str, bg_size: tuple[int, int], scale: float, position: str):
+    with _LOCK:
+        return _placed_layer(path, os.path.getmtime(path), tuple(bg_size), scale, position)
+
+
+def composite(bg: Image.Image, layer_path: str, position: str = "top", scale: float = 0.6) -> Image.Image:
+    bg = bg.convert("RGBA")
+    txt, xy = placed_layer(layer_path, bg.size, scale, position)
+    bg.alpha_composite(txt, xy)
+    return bg
+
+
+def composite_file(
+    background_path: str,
+    layer_path: str,
+    output_path: str,
+    position: str = "top",
+    scale: float = 0.6,
+) -> None:
+    with Image.open(background_path) as bg:
+        result = composite(bg, layer_path, position, scale)
+    with open(output_path, "wb") as f:
+        f.write(transcode.encode_image(result, transcode.format_for_path(output_path)))
+
+
+
+# ================== RENDER ==================
+
+def parse_color(value: str) -> tuple[int, int, int, int]:
+    """
+    Цвет в нотации ffmpeg/PIL: "white", "#ffcc00", "black@0.35"
+    """
+    alpha = 1.0
+    if "@" in value:
+        value, a = value.split("@", 1)
+        alpha = float(a)
+    r, g, b = ImageColor.getrgb(value)[:3]
+    return r, g, b, int(round(alpha * 255))
+
+
+@lru_cache(maxsize=16)
+def _font(font_path: str | None, size: int):
+    try:
+        return ImageFont.truetype(font_path or DEFAULT_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=4096)
+def _glyph(font_path: str | None, size: int, ch: str, color: tuple, stroke_width: int, stroke_color: tuple):
+    """
+    Растр одного символа: (RGBA, dx, dy, advance) относительно пера
+    """
+    font = _font(font_path, size)
+    advance = font.getlength(ch)
+    left, top, right, bottom = font.getbbox(ch, stroke_width=stroke_width)
+    if right <= left or bottom <= top:
+        return None, 0, 0, advance
+
+    img = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+    ImageDraw.Draw(img).text(
+        (-left, -top),
+        ch,
+        font=font,
+        fill=color,
+        stroke_width=stroke_width,
+        stroke_fill=stroke_color,
+    )
+    return img, left, top, advance
+
+
+def _wrap(text: str, font, max_width: int | None) -> list[str]:
+    lines = []
+    for paragraph in text.split("\n"):
+        if not max_width:
+            lines.append(paragraph)
+            continue
+        current = ""
+        for word in paragraph.split():
+            candidate = f"{current} {word}".strip()
+            if current and font.getlength(candidate) > max_width:
+                lines.append(current)
+                current = word
+            else:
+                current = candidate
+        lines.append(current)
+    return lines
+
+
+@lru_cache(maxsize=32)
+def _render(key: str, spec: tuple) -> Image.Image:
+    (text, font_path, font_size, color, stroke_width, stroke_color,
+     box_color, line_spacing, max_width, padding, align) = spec
+    font = _font(font_path, font_size)
+    ascent, descent = font.getmetrics()
+    line_h = int((ascent + descent) * line_spacing)
+
+    lines = _wrap(text, font, max_width)
+    widths = [int(sum(font.getlength(ch) for ch in line)) + 2 * stroke_width for line in lines]
+    width = max(widths or [1]) + 2 * padding
+    height = line_h * len(lines) - (line_h - ascent - descent) + 2 * padding + 2 * stroke_width
+
+    layer = Image.new("RGBA", (max(1, width), max(1, height)), box_color or (0, 0, 0, 0))
+    for i, line in enumerate(lines):
+        if align == "center":
+            pen = padding + (width - 2 * padding - widths[i]) / 2 + stroke_width
+        else:
+            pen = padding + stroke_width
+        y = padding + stroke_width + i * line_h
+        for ch in line:
+            img, dx, dy, advance = _glyph(font_path, font_size, ch, color, stroke_width, stroke_color)
+            if img is not None:
+                layer.alpha_composite(img, (int(pen + dx), y + dy))
+            pen += advance
+    return layer
+
+
+def render_text_layer(
+    text: str,
+    font_path: str | None = None,
+    font_size: int = 72,
+    color: str = "white",
+    stroke_width: int = 0,
+    stroke_color: str = "black",
+    box_color: str | None = None,
+    line_spacing: float = 1.15,
+    max_width: int | None = None,
+    padding: int = 10,
+    align: str = "center",
+) -> tuple[Image.Image, str]:
+    """
+    Рисует текстовый слой (RGBA) из строки вместо ручного text_layer.png.
+    Глифы и готовые слои кэшируются; возвращает (слой, хэш содержимого)
+    """
+    spec = (
+        text, font_path or None, int(font_size), parse_color(color), int(stroke_width),
+        parse_color(stroke_color), parse_color(box_color) if box_color else None,
+        float(line_spacing), max_width, int(padding), align,
+    )
+    key = hashlib.sha256(json.dumps(spec, ensure_ascii=False).encode()).hexdigest()[:16]
+    with _LOCK:
+        return _render(key, spec), key
+
+
+def render_text_layer_file(text: str, out_dir: str = LAYERS_DIR, **style) -> str:
+    """
+    PNG слоя на диске (для наложения на пины и для ffmpeg overlay);
+    повторный вызов с тем же текстом и стилем возвращает готовый файл
+    """
+    layer, key = render_text_layer(text, **style)
+    path = os.path.join(out_dir, f"{key}.png")
+    if not os.path.isfile(path):
+        os.makedirs(out_dir, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        layer.save(tmp, format="PNG")
+        os.replace(tmp, path)
+    return path
+
+
 if __name__ == "__main__":
     crop_to_content(
         input_path="text_layer.png",
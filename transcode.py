@@ -0,0 +1,91 @@
+import io
+
+from PIL import Image, ImageOps
+
+import settings
+
+# ================== CONFIG ==================
+
+# Pinterest рекомендует ширину 1000 px; больше Late/Pinterest всё равно ужмут
+DEFAULT_MAX_WIDTH = 1000
+DEFAULT_MAX_HEIGHT = 1500
+DEFAULT_QUALITY = 85
+
+FORMATS = {
+    "jpeg": ".jpg",
+    "webp": ".webp",
+}
+
+
+def output_format() -> str:
+    fmt = (settings.get_setting("output_image_format", default="jpeg") or "jpeg").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in FORMATS:
+        raise RuntimeError(f"Unsupported output_image_format: {fmt}")
+    return fmt
+
+
+def output_ext() -> str:
+    return FORMATS[output_format()]
+
+
+def format_for_path(path: str) -> str:
+    return "webp" if path.lower().endswith(".webp") else "jpeg"
+
+
+# ================== ENCODE ==================
+
+def encode_image(img: Image.Image, fmt: str | None = None) -> bytes:
+    """
+    Уменьшает до целевого размера Pinterest и кодирует в progressive JPEG
+    или WebP без EXIF/ICC и прочих метаданных
+    """
+    fmt = fmt or output_format()
+    max_w = int(settings.get_setting("output_image_max_width", default=DEFAULT_MAX_WIDTH))
+    max_h = int(settings.get_setting("output_image_max_height", default=DEFAULT_MAX_HEIGHT))
+    quality = int(settings.get_setting("output_image_quality", default=DEFAULT_QUALITY))
+
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "L"):
+        if "A" in img.getbands():
+            bg = Image.new("RGB", img.size, (255, 255, 255))
+            bg.paste(img.convert("RGBA"), mask=img.convert("RGBA").getchannel("A"))
+            img = bg
+        else:
+            img = img.convert("RGB")
+
+    if img.width > max_w or img.height > max_h:
+        img = img.copy()
+        img.thumbnail((max_w, max_h), Image.LANCZOS)
+
+    out = io.BytesIO()
+    if fmt == "webp":
+        img.save(out, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(out, format="JPEG", quality=quality, progressive=True, optimize=True)
+    return out.getvalue()
+
+
+def transcode_bytes(data: bytes, fmt: str | None = None) -> bytes:
+    """
+    Декодирует ответ модели (обычно большой PNG) один раз и перекодирует
+    """
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return encode_image(img, fmt)
+
+
+def save_generated(data: bytes, path: str, fmt: str | None = None) -> int:
+    """
+    Перекодирует и записывает картинку. Если байты не декодируются,
+    бросает RuntimeError и ничего не пишет: сырой PNG под именем .jpg/.webp
+    ломает загрузку в Late. Возвращает размер записанного файла.
+    """
+    try:
+        encoded = transcode_bytes(data, fmt)
+    except Exception as e:
+        raise RuntimeError(f"Transcode failed for {path}: {e}") from e
+    with open(path, "wb") as f:
+        f.write(encoded)
+    return len(encoded)
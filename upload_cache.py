@@ -0,0 +1,58 @@
+import json
+import os
+import threading
+import time
+
+import checkpoint
+
+
+class UploadCache:
+    """
+    JSON-кэш загрузок по sha256 содержимого: {digest: {..., "expires_at": ts}}.
+    Один файл на источник (Gemini Files, Late media), запись атомарная
+    через checkpoint.atomic_write_json; одно содержимое не грузится
+    параллельно дважды
+    """
+
+    def __init__(self, path: str, margin_sec: float = 0):
+        self.path = path
+        # не отдаём запись, если до истечения меньше margin_sec
+        self.margin_sec = margin_sec
+        self._lock = threading.Lock()
+        self._hash_locks: dict[str, threading.Lock] = {}
+
+    def _load(self) -> dict:
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, digest: str) -> dict | None:
+        with self._lock:
+            entry = self._load().get(digest)
+        if entry and entry.get("expires_at", 0) - self.margin_sec > time.time():
+            return entry
+        return None
+
+    def put(self, digest: str, entry: dict) -> None:
+        with self._lock:
+            now = time.time()
+            cache = {k: v for k, v in self._load().items() if v.get("expires_at", 0) > now}
+            cache[digest] = entry
+            checkpoint.atomic_write_json(self.path, cache)
+
+    def get_or_create(self, digest: str, create) -> dict:
+        """
+        Запись из кэша или create() -> entry (с expires_at), сохранённая в кэш
+        """
+        with self._lock:
+            lock = self._hash_locks.setdefault(digest, threading.Lock())
+        with lock:
+            entry = self.get(digest)
+            if entry is None:
+                entry = create()
+                self.put(digest, entry)
+            return entry
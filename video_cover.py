@@ -0,0 +1,84 @@
+import os
+
+import encode_pool
+import settings
+
+# ================== CONFIG ==================
+
+# Превью для просмотра результатов без скачивания mp4 целиком (в Late не уходит)
+THUMB_WIDTH = 240
+# thumbnail выбирает самый типичный кадр из первых N (≈2 с при 30 fps)
+BEST_FRAME_WINDOW = 60
+
+
+def enabled() -> bool:
+    return bool(settings.get_setting("video_cover", default=True))
+
+
+def path(mp4_path: str) -> str:
+    return f"{os.path.splitext(mp4_path)[0]}.cover.jpg"
+
+
+def preview_path(mp4_path: str) -> str:
+    return f"{os.path.splitext(mp4_path)[0]}.thumb.jpg"
+
+
+def find(mp4_path: str) -> str | None:
+    cover = path(mp4_path)
+    return cover if os.path.isfile(cover) else None
+
+
+def _offset() -> float:
+    return float(settings.get_setting("video_cover_offset_sec", default=1.0))
+
+
+def _select() -> str:
+    # best — кадр, ближайший к среднему по окну; offset — фиксированное время
+    if settings.get_setting("video_cover_mode", default="best") == "best":
+        return f"thumbnail=n={BEST_FRAME_WINDOW}"
+    return f"select='gte(t,{_offset()})'"
+
+
+# ================== FFMPEG ==================
+
+def graph(src_label: str) -> str:
+    """
+    Продолжение filter_complex: [src] делится на видео [vout],
+    обложку [cover] и превью [thumb] — всё в том же проходе
+    """
+    return f"[{src_label}]split=2[vout][c];{_frame_graph('c')}"
+
+
+def _frame_graph(src_label: str) -> str:
+    return f"[{src_label}]{_select()},split=2[cover][t];[t]scale={THUMB_WIDTH}:-2[thumb]"
+
+
+def output_args(mp4_path: str) -> list[str]:
+    return [
+        "-map", "[cover]", "-frames:v", "1", "-q:v", "2", path(mp4_path),
+        "-map", "[thumb]", "-frames:v", "1", "-q:v", "4", preview_path(mp4_path),
+    ]
+
+
+def extract(mp4_path: str) -> str:
+    """
+    Для видео без своего прохода ffmpeg (скачанных как есть): обложка
+    и превью одним запуском через encode_pool, декодируется только окно
+    выбора кадра
+    """
+    cover = path(mp4_path)
+    if settings.get_setting("video_cover_mode", default="best") == "best":
+        seek, frames = [], _frame_graph("0:v")
+    else:
+        # быстрый seek по ключевым кадрам вместо декодирования до offset
+        seek, frames = ["-ss", str(_offset())], f"[0:v]split=2[cover][t];[t]scale={THUMB_WIDTH}:-2[thumb]"
+    encode_pool.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            *seek, "-i", mp4_path,
+            "-filter_complex", frames,
+            *output_args(mp4_path),
+        ],
+        label=os.path.basename(cover),
+    )
+    return cover
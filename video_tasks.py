@@ -0,0 +1,168 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import encode_pool
+import main3
+import poll_schedule
+import settings
+import webhook
+
+# ================== CONFIG ==================
+
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_TIMEOUT_SEC = 900
+
+
+def max_in_flight() -> int:
+    return max(1, int(settings.get_setting("freepik_max_in_flight", default=DEFAULT_MAX_IN_FLIGHT)))
+
+
+# ================== ORCHESTRATOR ==================
+
+def _finish(job: dict, result: dict) -> None:
+    main3.complete_video_task(result, job["download_path"], overlay=job.get("overlay"))
+    if job.get("on_done"):
+        job["on_done"]()
+
+
+def _next_poll(task: dict, now: float) -> float:
+    # С webhook опрос — редкий запасной вариант, без него — по расписанию
+    if webhook.active():
+        return now + webhook.fallback_poll_sec()
+    return now + task["schedule"].next_delay(now - task["submitted_at"])
+
+
+def run_video_jobs(
+    jobs: list[dict],
+    limit: int | None = None,
+    timeout_sec: float = DEFAULT_TIMEOUT_SEC,
+) -> dict[str, Exception]:
+    """
+    Отправляет задачи Freepik сразу (не больше limit одновременно),
+    опрашивает все незавершённые одним циклом и отдаёт готовые
+    на скачивание / постобработку в пул, не дожидаясь остальных.
+
+    job: label, account_alias, image, prompt, negative_prompt, duration, cfg_scale,
+    download_path, overlay и on_done (необязательно). Возвращает {label: ошибка}.
+    """
+    limit = limit or max_in_flight()
+    queue = list(jobs)
+    in_flight: dict[str, dict] = {}
+    errors: dict[str, Exception] = {}
+    post_futures = {}
+
+    if not queue:
+        return errors
+
+    print(f"🎬 Freepik: {len(queue)} задач, одновременно до {limit}")
+    # Скачивание и кодирование ограничены своими лимитами (main3.download_video,
+    # encode_pool), пул постобработки — под оба сразу
+    post_workers = max(1, int(settings.get_setting("video_download_concurrency", default=3))) + encode_pool.workers()
+    with ThreadPoolExecutor(max_workers=post_workers) as post_pool:
+        while queue or in_flight:
+            while queue and len(in_flight) < limit:
+                job = queue.pop(0)
+                duration = job.get("duration", "5")
+                try:
+                    task_id = main3.submit_video_task(
+                        image_path_or_url=job["image"],
+                        prompt=job["prompt"],
+                        negative_prompt=job.get("negative_prompt", ""),
+                        duration=duration,
+                        cfg_scale=job.get("cfg_scale", 0.5),
+                        account_alias=job.get("account_alias"),
+                    )
+                except Exception as e:
+                    errors[job["label"]] = e
+                    continue
+                now = time.time()
+                task = {
+                    "job": job,
+                    "submitted_at": now,
+                    "schedule": poll_schedule.PollSchedule(main3.FREEPIK_MODEL, duration),
+                }
+                task["next_poll"] = _next_poll(task, now)
+                in_flight[task_id] = task
+
+            signaled = webhook.wait_for(in_flight, timeout=0) if webhook.active() else set()
+            for task_id, task in list(in_flight.items()):
+                job = task["job"]
+                now = time.time()
+                elapsed = now - task["submitted_at"]
+                if task_id in signaled and now < task.get("hold_until", 0):
+                    # Повторный webhook раньше срока после неготовой задачи — не опрашиваем
+                    webhook.forget(task_id)
+                    signaled.discard(task_id)
+                if task_id not in signaled and now < task["next_poll"]:
+                    if elapsed > timeout_sec:
+                        del in_flight[task_id]
+                        task["schedule"].finish(task_id, elapsed, completed=False)
+                        errors[job["label"]] = TimeoutError(f"Task timed out: {task_id}")
+                    continue
+
+                webhook.forget(task_id)
+                try:
+                    resp = main3.get_task_status(task_id)
+                except Exception as e:
+                    del in_flight[task_id]
+                    errors[job["label"]] = e
+                    continue
+                task["schedule"].polled()
+
+                status = (resp.get("data") or {}).get("status")
+                if status in ("COMPLETED", "FAILED"):
+                    del in_flight[task_id]
+                    task["schedule"].finish(task_id, elapsed, completed=status == "COMPLETED")
+                    post_futures[post_pool.submit(_finish, job, resp)] = job
+                elif elapsed > timeout_sec:
+                    del in_flight[task_id]
+                    task["schedule"].finish(task_id, elapsed, completed=False)
+                    errors[job["label"]] = TimeoutError(f"Task timed out: {task_id}")
+                else:
+                    task["next_poll"] = _next_poll(task, now)
+                    if task_id in signaled:
+                        task["hold_until"] = now + task["schedule"].next_delay(elapsed)
+
+            if not in_flight:
+                continue
+            sleep_for = max(0.0, min(t["next_poll"] for t in in_flight.values()) - time.time())
+            if webhook.active():
+                webhook.wait_for(in_flight, timeout=sleep_for)
+            else:
+                time.sleep(sleep_for)
+
+        wait(post_futures)
+
+    for fut, job in post_futures.items():
+        if fut.exception():
+            errors[job["label"]] = fut.exception()
+
+    print(f"🏁 Freepik: готово {len(jobs) - len(errors)}/{len(jobs)}")
+    return errors
+
+
+def run_local_jobs(jobs: list[dict]) -> dict[str, Exception]:
+    """
+    Те же задачи, но видео рендерится локально (video_engine = local):
+    без API, параллельно в пределах пула кодирования
+    """
+    errors: dict[str, Exception] = {}
+    if not jobs:
+        return errors
+
+    def _render(job):
+        main3.render_local_video(job["image"], job["download_path"], job.get("duration", "5"), job.get("overlay"))
+        if job.get("on_done"):
+            job["on_done"]()
+
+    print(f"🎬 Local: {len(jobs)} видео")
+    with ThreadPoolExecutor(max_workers=encode_pool.workers()) as pool:
+        futures = {pool.submit(_render, job): job for job in jobs}
+        wait(futures)
+
+    for fut, job in futures.items():
+        if fut.exception():
+            errors[job["label"]] = fut.exception()
+
+    print(f"🏁 Local: готово {len(jobs) - len(errors)}/{len(jobs)}")
+    return errors
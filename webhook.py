@@ -0,0 +1,153 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+import settings
+
+# ================== CONFIG ==================
+
+WEBHOOK_PATH = "/freepik/webhook"
+DEFAULT_PORT = 8787
+DEFAULT_FALLBACK_POLL_SEC = 60
+
+_server: ThreadingHTTPServer | None = None
+_server_lock = threading.Lock()
+
+# Уведомления без ожидающей задачи (чужие или поддельные POST) живут
+# ограниченно, чтобы словарь не рос без предела
+PENDING_TTL_SEC = 3600
+MAX_PENDING = 1000
+
+# task_id -> время прихода webhook; условие будит всех, кто ждёт задачи
+_done: dict[str, float] = {}
+_cond = threading.Condition()
+
+
+def enabled() -> bool:
+    return bool(settings.get_setting("freepik_webhook_enabled", default=False))
+
+
+def fallback_poll_sec() -> float:
+    return float(settings.get_setting("freepik_webhook_fallback_poll_sec", default=DEFAULT_FALLBACK_POLL_SEC))
+
+
+def _task_id(payload: dict) -> str | None:
+    data = payload.get("data") if isinstance(payload.get("data"), dict) else payload
+    task_id = data.get("task_id") or data.get("id")
+    return str(task_id) if task_id else None
+
+
+# ================== STATE ==================
+
+def notify(task_id: str) -> None:
+    now = time.time()
+    with _cond:
+        for stale in [k for k, at in _done.items() if now - at > PENDING_TTL_SEC]:
+            del _done[stale]
+        _done.pop(task_id, None)
+        while len(_done) >= MAX_PENDING:
+            del _done[next(iter(_done))]
+        _done[task_id] = now
+        _cond.notify_all()
+
+
+def wait_for(task_ids, timeout: float) -> set[str]:
+    """
+    Ждёт webhook по любой из задач не дольше timeout;
+    возвращает задачи, по которым он уже пришёл
+    """
+    task_ids = set(task_ids)
+    deadline = time.time() + timeout
+    with _cond:
+        while True:
+            ready = task_ids & _done.keys()
+            left = deadline - time.time()
+            if ready or left <= 0:
+                return ready
+            _cond.wait(left)
+
+
+def forget(task_id: str) -> None:
+    with _cond:
+        _done.pop(task_id, None)
+
+
+# ================== SERVER ==================
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path.split("?", 1)[0] != WEBHOOK_PATH:
+            self.send_response(404)
+            self.end_headers()
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, OSError):
+            self.send_response(400)
+            self.end_headers()
+            return
+
+        task_id = _task_id(payload) if isinstance(payload, dict) else None
+        if task_id:
+            notify(task_id)
+            print(f"📬 Freepik webhook: {task_id}")
+        self.send_response(200 if task_id else 400)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(host: str | None = None, port: int | None = None) -> ThreadingHTTPServer:
+    global _server
+    with _server_lock:
+        if _server is None:
+            host = host or settings.get_setting("freepik_webhook_host", default="0.0.0.0")
+            port = int(port if port is not None else settings.get_setting("freepik_webhook_port", default=DEFAULT_PORT))
+            _server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            print(f"🛰 Freepik webhook server: {host}:{_server.server_address[1]}{WEBHOOK_PATH}")
+        return _server
+
+
+def stop() -> None:
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
+
+
+def active() -> bool:
+    return _server is not None
+
+
+def callback_url() -> str | None:
+    """
+    URL для webhook_url задачи Freepik; сервер поднимается при первом вызове.
+    None, если webhook выключен или не задан публичный адрес
+    """
+    if not enabled():
+        return None
+    public_url = (settings.get_setting("freepik_webhook_public_url") or "").rstrip("/")
+    if not public_url:
+        print("⚠ freepik_webhook_public_url не задан, webhook выключен")
+        return None
+    start()
+    return public_url + WEBHOOK_PATH
+
+
+# ================== RUN ==================
+
+if __name__ == "__main__":
+    # Локальная проверка: поднимает сервер и шлёт себе фейковый webhook
+    server = start(host="127.0.0.1", port=0)
+    url = f"http://127.0.0.1:{server.server_address[1]}{WEBHOOK_PATH}"
+    threading.Timer(0.5, lambda: requests.post(url, json={"task_id": "fake-task", "status": "COMPLETED"}, timeout=5)).start()
+    print("ready:", wait_for({"fake-task"}, timeout=5))
+    stop()